@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Compares the BibScanner engine to the geninterp-based BibInterpreter.
+
+Either pass existing .bib files, or let the script generate a synthetic
+bibliography with --entries N.
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import argparse
+import random
+from timeit import default_timer
+
+import texhelp
+
+
+ENTRY_TEMPLATE = """@article{{{citename},
+    author        = "{author} and others",
+    title         = "Measurement of {{H}}iggs boson production at {{$\\sqrt{{s}}$}} = {energy} {{TeV}}, part {i}",
+    collaboration = "CMS",
+    journal       = "Phys. Lett. B",
+    volume        = "{volume}",
+    year          = "{year}",
+    pages         = "{pages}",
+    doi           = "10.1016/j.physletb.{year}.{i}",
+    eprint        = "{year}.{i:05d}",
+    archivePrefix = "arXiv",
+    primaryClass  = "hep-ex",
+    SLACcitation  = "%%CITATION = ARXIV:{year}.{i:05d};%%"
+    }}
+"""
+
+def synthetic_bib(n_entries, seed=1):
+    rng = random.Random(seed)
+    entries = []
+    for i in xrange(n_entries):
+        entries.append(ENTRY_TEMPLATE.format(
+            citename = 'Author:{0}abc'.format(i),
+            author = rng.choice(['Khachatryan, Vardan', 'Aad, Georges', 'Sirunyan, Albert M']),
+            energy = rng.choice([7, 8, 13]),
+            volume = rng.randint(600, 800),
+            year = rng.randint(2010, 2019),
+            pages = rng.randint(1, 999),
+            i = i,
+            ))
+    return '\n'.join(entries)
+
+
+def time_engine(interpreter, text):
+    t0 = default_timer()
+    tree = interpreter.interpret(text)
+    entries = [ node.block.get_text() for node in tree.gen_blocks_by_name('entry') ]
+    return default_timer() - t0, entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bibfiles', metavar='N', type=str, nargs='*', help='bib files to scan')
+    parser.add_argument('--entries', type=int, default=2000, help='number of synthetic entries')
+    parser.add_argument('--skip-geninterp', action='store_true', help='only time the scanner')
+    args = parser.parse_args()
+
+    if args.bibfiles:
+        texts = []
+        for bibfile in args.bibfiles:
+            with open(bibfile, 'r') as fp:
+                texts.append(fp.read())
+        text = '\n'.join(texts)
+    else:
+        text = synthetic_bib(args.entries)
+    mb = len(text) / 1e6
+
+    t_scan, scanned = time_engine(texhelp.BibScanner(), text)
+    print 'BibScanner:     {0:8.3f} s  {1:8.2f} MB/s  {2:8.0f} entries/s'.format(
+        t_scan, mb / t_scan, len(scanned) / t_scan
+        )
+
+    if not args.skip_geninterp:
+        t_interp, interpreted = time_engine(texhelp.BibInterpreter(), text)
+        print 'BibInterpreter: {0:8.3f} s  {1:8.2f} MB/s  {2:8.0f} entries/s'.format(
+            t_interp, mb / t_interp, len(interpreted) / t_interp
+            )
+        print 'Speedup: {0:.1f}x'.format(t_interp / t_scan)
+        if scanned != interpreted:
+            print 'WARNING: engines disagree ({0} vs {1} entries)'.format(
+                len(scanned), len(interpreted)
+                )
+
+
+if __name__ == '__main__':
+    main()
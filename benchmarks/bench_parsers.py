@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""
+Throughput benchmarks of the tex and bib parsers on reproducible synthetic
+corpora.
+
+Every benchmark runs in a forked child process, so that its peak memory can
+be measured separately. Results can be stored as a JSON baseline with
+--save-baseline, and later runs compared to it with --baseline; the script
+exits with status 1 if any benchmark regressed by more than --tolerance.
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import argparse
+import json
+import random
+import shutil
+import logging
+import tempfile
+import traceback
+import cPickle as pickle
+from timeit import default_timer
+
+import texhelp
+from bench_bib_scanner import synthetic_bib
+
+
+#____________________________________________________________________
+# Synthetic corpora
+
+WORDS = (
+    'measurement of the production cross section in proton collisions with '
+    'the detector at the large hadron collider using events recorded during '
+    'search for new physics decaying into pairs of leptons jets and photons'
+    ).split()
+TITLE_PIECES = [
+    'Higgs', 'CMS', 'ATLAS', 'LHC', 'SU(3)', 'GeV', 'TeV', '$\\sqrt{s}$', '$pp$',
+    '$t\\bar{t}$', '$H\\to\\gamma\\gamma$', '{W}', 'Boson', 'Search', 'Measurement',
+    ]
+
+
+def synthetic_paragraph(rng, n_words=80):
+    words = []
+    for i_word in xrange(n_words):
+        r = rng.random()
+        if r < 0.03:
+            words.append('\\cite{{Author:{0}abc}}'.format(rng.randint(0, 9999)))
+        elif r < 0.05:
+            words.append('${0}_{{{1}}}$'.format(rng.choice('xyzE'), rng.randint(0, 9)))
+        elif r < 0.06:
+            words.append('% a comment with a \\cite{commented}\n')
+        else:
+            words.append(rng.choice(WORDS))
+    return ' '.join(words) + '\n\n'
+
+
+def synthetic_tex_body(rng, i_file, n_paragraphs):
+    out = [ '\\section{{Section {0}}}\n'.format(i_file) ]
+    for i_paragraph in xrange(n_paragraphs):
+        if i_paragraph % 4 == 1:
+            out.append('\\subsection{{Part {0}.{1}}}\n'.format(i_file, i_paragraph))
+        if i_paragraph % 5 == 2:
+            out.append(
+                '\\begin{{figure}}\n\\includegraphics[width=0.5\\textwidth]{{img/fig{0}_{1}}}\n'
+                '\\caption{{Figure {0}.{1}}}\n\\end{{figure}}\n'
+                .format(i_file, i_paragraph)
+                )
+        out.append(synthetic_paragraph(rng))
+    return ''.join(out)
+
+
+def synthetic_tex_tree(root, depth=6, fanout=4, n_paragraphs=10, seed=1):
+    """
+    Writes a tex project to root and returns the path of its main file.
+
+    main.tex \\inputs a chain of depth files, and \\imports fanout chapters
+    that each \\subimport fanout parts; every part \\inputs a shared macros
+    file.
+    """
+    rng = random.Random(seed)
+    files = {}
+    files['macros.tex'] = '\\newcommand{\\pt}{p_{T}}\n\\providecommand{\\GeV}{GeV}\n'
+
+    main = [ '\\input{macros}\n', synthetic_tex_body(rng, 0, n_paragraphs), '\\input{chain/level1}\n' ]
+    for i_level in xrange(1, depth + 1):
+        text = synthetic_tex_body(rng, i_level, n_paragraphs)
+        if i_level < depth:
+            text += '\\input{{chain/level{0}}}\n'.format(i_level + 1)
+        files['chain/level{0}.tex'.format(i_level)] = text
+
+    for i_chapter in xrange(fanout):
+        main.append('\\import{{chapters/}}{{chapter{0}}}\n'.format(i_chapter))
+        chapter = [ synthetic_tex_body(rng, i_chapter, n_paragraphs) ]
+        for i_part in xrange(fanout):
+            chapter.append('\\subimport{{parts/}}{{part{0}_{1}}}\n'.format(i_chapter, i_part))
+            files['chapters/parts/part{0}_{1}.tex'.format(i_chapter, i_part)] = (
+                '\\input{macros}\n' + synthetic_tex_body(rng, i_part, n_paragraphs)
+                )
+        files['chapters/chapter{0}.tex'.format(i_chapter)] = ''.join(chapter)
+    files['main.tex'] = ''.join(main)
+
+    for relpath, text in files.items():
+        path = os.path.join(root, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(text)
+    return os.path.join(root, 'main.tex')
+
+
+def synthetic_titles(n_titles, n_words=25, seed=1):
+    rng = random.Random(seed)
+    titles = []
+    for i_title in xrange(n_titles):
+        words = []
+        for i_word in xrange(n_words):
+            if rng.random() < 0.25:
+                words.append(rng.choice(TITLE_PIECES))
+            else:
+                word = rng.choice(WORDS)
+                words.append(word.capitalize() if rng.random() < 0.3 else word)
+        titles.append(' '.join(words))
+    return titles
+
+
+def get_corpus_size(paths):
+    return sum( os.path.getsize(path) for path in paths )
+
+#____________________________________________________________________
+# Benchmarks; each returns (seconds, n_bytes, n_entries)
+
+def bench_tex_interpreter(corpus):
+    interpreter = texhelp.TexInterpreter()
+    interpreter.set_base_file(corpus['main_tex'])
+    t0 = default_timer()
+    interpreter.interpret_file(corpus['main_tex'])
+    return default_timer() - t0, corpus['tex_bytes'], corpus['tex_files']
+
+def bench_tex_project(corpus):
+    t0 = default_timer()
+    texhelp.TexProject(corpus['main_tex'])
+    return default_timer() - t0, corpus['tex_bytes'], corpus['tex_files']
+
+def bench_tex_flat(corpus):
+    t0 = default_timer()
+    tree = texhelp.FlatTexInterpreter().interpret_file(corpus['main_tex'])
+    len(list(tree.gen_blocks_by_name('cite')))
+    return default_timer() - t0, corpus['tex_bytes'], corpus['tex_files']
+
+def bench_tex_flat_brackets(corpus):
+    t0 = default_timer()
+    tree = texhelp.FlatTexInterpreter(brackets=True).interpret_file(corpus['main_tex'])
+    len(list(tree.gen_blocks_by_name('cite')))
+    return default_timer() - t0, corpus['tex_bytes'], corpus['tex_files']
+
+def bench_bib_interpreter(corpus):
+    t0 = default_timer()
+    tree = texhelp.BibInterpreter().interpret_file(corpus['bibfile'])
+    n_entries = len(list(tree.gen_blocks_by_name('entry')))
+    return default_timer() - t0, corpus['bib_bytes'], n_entries
+
+def bench_bib_scanner(corpus):
+    t0 = default_timer()
+    tree = texhelp.BibScanner().interpret_file(corpus['bibfile'])
+    n_entries = len(list(tree.gen_blocks_by_name('entry')))
+    return default_timer() - t0, corpus['bib_bytes'], n_entries
+
+def bench_get_citation(corpus):
+    raws = list(texhelp.iter_bib_entries(corpus['bibfile']))[:corpus['n_citations']]
+    formatter = texhelp.BibFormatter()
+    t0 = default_timer()
+    for raw in raws:
+        formatter.get_citation(raw)
+    return default_timer() - t0, sum( len(raw) for raw in raws ), len(raws)
+
+def bench_reinterpreted_title(corpus):
+    titles = corpus['titles']
+    formatter = texhelp.bib_formatter.CMSCiteFormatter('@article{', {})
+    t0 = default_timer()
+    for title in titles:
+        formatter.get_reinterpreted_title(title)
+    return default_timer() - t0, sum( len(title) for title in titles ), len(titles)
+
+BENCHMARKS = [
+    ('tex_interpreter', bench_tex_interpreter),
+    ('tex_project', bench_tex_project),
+    ('tex_flat', bench_tex_flat),
+    ('tex_flat_brackets', bench_tex_flat_brackets),
+    ('bib_interpreter', bench_bib_interpreter),
+    ('bib_scanner', bench_bib_scanner),
+    ('get_citation', bench_get_citation),
+    ('reinterpreted_title', bench_reinterpreted_title),
+    ]
+
+#____________________________________________________________________
+# Running and comparing
+
+def run_in_child(function, corpus, repeat):
+    """
+    Runs function repeat times in a forked child, and returns a dict with the
+    best time, the throughput and the child's peak RSS, or the error
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            logging.disable(logging.CRITICAL)
+            best = None
+            for i_repeat in xrange(repeat):
+                seconds, n_bytes, n_entries = function(corpus)
+                if best is None or seconds < best[0]:
+                    best = (seconds, n_bytes, n_entries)
+            result = {
+                'seconds' : best[0],
+                'mb_per_s' : best[1] / 1e6 / best[0],
+                'entries_per_s' : best[2] / best[0],
+                }
+        except Exception:
+            result = { 'error' : traceback.format_exc().strip().split('\n')[-1] }
+        with os.fdopen(write_fd, 'wb') as fp:
+            pickle.dump(result, fp)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as fp:
+        data = fp.read()
+    _, status, rusage = os.wait4(pid, 0)
+    if not data:
+        return { 'error' : 'child exited with status {0}'.format(status) }
+    result = pickle.loads(data)
+    if not 'error' in result:
+        # ru_maxrss is in kB on Linux
+        result['peak_rss_mb'] = rusage.ru_maxrss / 1024.
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of messages, one per regressed quantity"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None or 'error' in result or 'error' in reference: continue
+        if result['mb_per_s'] < reference['mb_per_s'] * (1. - tolerance):
+            regressions.append('{0}: throughput {1:.2f} MB/s, baseline {2:.2f} MB/s'.format(
+                name, result['mb_per_s'], reference['mb_per_s']
+                ))
+        if result['peak_rss_mb'] > reference['peak_rss_mb'] * (1. + tolerance):
+            regressions.append('{0}: peak memory {1:.1f} MB, baseline {2:.1f} MB'.format(
+                name, result['peak_rss_mb'], reference['peak_rss_mb']
+                ))
+    return regressions
+
+
+def print_results(results):
+    print '{0:<20} {1:>9} {2:>9} {3:>12} {4:>10}'.format('benchmark', 'time [s]', 'MB/s', 'entries/s', 'peak MB')
+    for name, function in BENCHMARKS:
+        if not name in results: continue
+        result = results[name]
+        if 'error' in result:
+            print '{0:<20} failed: {1}'.format(name, result['error'])
+        else:
+            print '{0:<20} {seconds:9.3f} {mb_per_s:9.2f} {entries_per_s:12.0f} {peak_rss_mb:10.1f}'.format(
+                name, **result
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--entries', type=int, default=10000, help='number of synthetic bib entries')
+    parser.add_argument('--citations', type=int, default=2000, help='number of entries to format')
+    parser.add_argument('--titles', type=int, default=5000, help='number of synthetic titles')
+    parser.add_argument('--depth', type=int, default=6, help='depth of the \\input chain')
+    parser.add_argument('--fanout', type=int, default=4, help='number of chapters, and of parts per chapter')
+    parser.add_argument('--paragraphs', type=int, default=10, help='paragraphs per tex file')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark; the fastest counts')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-k', '--only', type=str, nargs='*', help='only run these benchmarks')
+    parser.add_argument('--baseline', type=str, help='JSON file to compare the results to')
+    parser.add_argument('--save-baseline', type=str, help='write the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative regression')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        main_tex = synthetic_tex_tree(
+            os.path.join(workdir, 'tex'), args.depth, args.fanout, args.paragraphs, args.seed
+            )
+        tex_paths = [
+            os.path.join(dirpath, filename)
+            for dirpath, dirnames, filenames in os.walk(os.path.dirname(main_tex)) for filename in filenames
+            ]
+        bibfile = os.path.join(workdir, 'synthetic.bib')
+        with open(bibfile, 'w') as fp:
+            fp.write(synthetic_bib(args.entries, args.seed))
+        corpus = {
+            'main_tex' : main_tex,
+            'tex_bytes' : get_corpus_size(tex_paths),
+            'tex_files' : len(tex_paths),
+            'bibfile' : bibfile,
+            'bib_bytes' : get_corpus_size([bibfile]),
+            'n_citations' : args.citations,
+            'titles' : synthetic_titles(args.titles, seed=args.seed),
+            }
+        print 'Corpus: {0} tex files ({1:.2f} MB), {2} bib entries ({3:.2f} MB), {4} titles'.format(
+            corpus['tex_files'], corpus['tex_bytes'] / 1e6, args.entries, corpus['bib_bytes'] / 1e6,
+            len(corpus['titles'])
+            )
+
+        results = {}
+        for name, function in BENCHMARKS:
+            if args.only and not name in args.only: continue
+            results[name] = run_in_child(function, corpus, args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+        print 'Wrote baseline to {0}'.format(args.save_baseline)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print 'REGRESSIONS (tolerance {0:.0%}):'.format(args.tolerance)
+            for regression in regressions:
+                print '    ' + regression
+            sys.exit(1)
+        print 'No regressions with respect to {0}'.format(args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Startup latency of the texhelp subcommands.
+
+Every subcommand is run through bin/texhelp in a fresh interpreter. The
+import time is that of 'texhelp SUBCOMMAND --help', which imports what the
+subcommand needs and exits; the first output and total times are those of a
+run on a small synthetic project. The python row is the bare interpreter,
+the eager row imports every name of the texhelp package.
+"""
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import argparse
+import shutil
+import tempfile
+import subprocess
+from timeit import default_timer
+
+from bench_bib_scanner import synthetic_bib
+from bench_parsers import synthetic_tex_tree
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BIN_DIR = os.path.join(ROOT_DIR, 'bin')
+
+# (subcommand, arguments); the persistent indices keep geninterp out of the runs
+SUBCOMMANDS = [
+    ('bib', [ '{bib}' ]),
+    ('cites', [ '--index', '{tex}', '--bibs', '{bib}' ]),
+    ('figs', [ '--index', '{tex}' ]),
+    ('imgs', [ '--index', '{tex}' ]),
+    ('inputs', [ '--index', '{tex}' ]),
+    ('labels', [ '--index', '--xref', '{tex}' ]),
+    ('report', [ '--index', '{tex}' ]),
+    ('structure', [ '--index', '{tex}' ]),
+    ]
+
+EAGER_IMPORT = 'import texhelp\nfor name in texhelp.__all__: getattr(texhelp, name)\n'
+
+
+def get_env():
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    env['PYTHONPATH'] = os.pathsep.join([ ROOT_DIR ] + [ p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p ])
+    return env
+
+
+def time_command(command, env):
+    """Returns (seconds until the first line of output or None, total seconds)"""
+    with open(os.devnull, 'w') as devnull:
+        t_start = default_timer()
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=devnull, env=env)
+        first_line = proc.stdout.readline()
+        t_first = default_timer() - t_start if first_line else None
+        proc.communicate()
+        t_total = default_timer() - t_start
+    if proc.returncode != 0:
+        raise RuntimeError('{0} exited with status {1}'.format(' '.join(command), proc.returncode))
+    return t_first, t_total
+
+
+def best_of(command, env, repeat):
+    times = [ time_command(command, env) for i_repeat in xrange(repeat) ]
+    firsts = [ t_first for t_first, t_total in times if not(t_first is None) ]
+    return (min(firsts) if firsts else None), min( t_total for t_first, t_total in times )
+
+
+def format_seconds(seconds):
+    return '{0:>12}'.format('-') if seconds is None else '{0:12.4f}'.format(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--entries', type=int, default=200, help='number of synthetic bib entries')
+    parser.add_argument('--depth', type=int, default=2, help='depth of the \\input chain')
+    parser.add_argument('--fanout', type=int, default=2, help='number of chapters, and of parts per chapter')
+    parser.add_argument('--paragraphs', type=int, default=2, help='paragraphs per tex file')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per command; the fastest counts')
+    parser.add_argument('-k', '--only', type=str, nargs='*', help='only run these subcommands')
+    args = parser.parse_args()
+
+    env = get_env()
+    texhelp_bin = [ sys.executable, os.path.join(BIN_DIR, 'texhelp') ]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        tex = synthetic_tex_tree(os.path.join(tmpdir, 'tex'), args.depth, args.fanout, args.paragraphs)
+        bib = os.path.join(tmpdir, 'refs.bib')
+        with open(bib, 'w') as fp:
+            fp.write(synthetic_bib(args.entries))
+
+        print '{0:<12} {1:>12} {2:>12} {3:>12}'.format('subcommand', 'import [s]', 'first [s]', 'total [s]')
+        for name, code in [ ('python', 'pass'), ('eager', EAGER_IMPORT) ]:
+            print '{0:<12} {1} {2} {3}'.format(
+                name, format_seconds(best_of([ sys.executable, '-c', code ], env, args.repeat)[1]),
+                format_seconds(None), format_seconds(None)
+                )
+
+        for subcommand, arguments in SUBCOMMANDS:
+            if args.only and not subcommand in args.only: continue
+            command = texhelp_bin + [ subcommand ] + [ argument.format(tex=tex, bib=bib) for argument in arguments ]
+            try:
+                t_import = best_of(texhelp_bin + [ subcommand, '--help' ], env, args.repeat)[1]
+                # The first run builds the persistent indices
+                time_command(command, env)
+                t_first, t_total = best_of(command, env, args.repeat)
+            except RuntimeError as e:
+                print '{0:<12} failed: {1}'.format(subcommand, e)
+                continue
+            print '{0:<12} {1} {2} {3}'.format(
+                subcommand, format_seconds(t_import), format_seconds(t_first), format_seconds(t_total)
+                )
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+#____________________________________________________________________
+if __name__ == "__main__":
+    main()
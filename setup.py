@@ -11,18 +11,17 @@ setup(name='texhelp',
       test_suite='nose.collector',
       tests_require=['nose'],
       scripts=[
+        'bin/texhelp',
         'bin/texhelp-structure',
         'bin/texhelp-cites',
-        'bin/texhelp-ascii',
         'bin/texhelp-bib',
-        'bin/texhelp-flatten',
-        'bin/texhelp-commands',
-        'bin/texhelp-cmsfigrenaming',
         # 
-        # 'bin/texhelp-figs',
-        # 'bin/texhelp-imgs',
-        # 'bin/texhelp-cmp',
-        # 'bin/texhelp-inputs',
-        # 'bin/texhelp-labels',
+        'bin/texhelp-figs',
+        'bin/texhelp-imgs',
+        'bin/texhelp-cmp',
+        'bin/texhelp-inputs',
+        'bin/texhelp-watch',
+        'bin/texhelp-report',
+        'bin/texhelp-labels',
         ]
       )
\ No newline at end of file
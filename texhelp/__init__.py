@@ -1,9 +1,64 @@
-from tex_interpreter import (
-    BaseTexInterpreter, TexInterpreter
-    )
-from bib_interpreter import BibInterpreter
-from bib_formatter import BibFormatter
+import sys
+import importlib
+from types import ModuleType
+
+#____________________________________________________________________
+# Names are imported from their module on first access, so that a script
+# only pays for the modules (and geninterp) it actually uses
+
+# Module -> public names it provides
+_EXPORTS = [
+    ('tex_interpreter', [ 'BaseTexInterpreter', 'TexInterpreter' ]),
+    ('tex_scanner', [ 'scan_tex' ]),
+    ('tex_index', [ 'TexIndex', 'TexProject', 'open_project' ]),
+    ('prefetch', [ 'Prefetcher' ]),
+    ('tex_flat', [ 'FlatTexTree', 'FlatTexInterpreter' ]),
+    ('xref', [ 'XRefIndex' ]),
+    ('helper', [ 'Helper' ]),
+    ('img_inventory', [ 'ImageInventory', 'ImageReconciler', 'archive_images' ]),
+    ('bib_interpreter', [ 'BibInterpreter' ]),
+    ('bib_scanner', [ 'BibScanner', 'iter_bib_entries' ]),
+    ('bib_formatter', [ 'BibFormatter' ]),
+    ('bib_rules', [ 'RuleSet', 'Rule' ]),
+    ('bib_cache', [ 'CitationCache' ]),
+    ('bib_index', [ 'BibIndex' ]),
+    ('bib_dedup', [ 'BibDeduplicator' ]),
+    ('profiling', [ 'Profiler' ]),
+    ('watch', [ 'ProjectWatcher' ]),
+    ('report', [ 'gen_report_records', 'write_report' ]),
+    ('bib_tex_matcher', [ 'BibTexMatcher' ]),
+    ]
+
+_MODULES = set( module_name for module_name, names in _EXPORTS )
+# Public name -> module
+_NAMES = dict( (name, module_name) for module_name, names in _EXPORTS for name in names )
+
+__all__ = [ name for module_name, names in _EXPORTS for name in names ]
 
-from ascii_checker import AsciiChecker
 
-from bib_tex_matcher import BibTexMatcher
\ No newline at end of file
+class LazyModule(ModuleType):
+    """The texhelp package; exported names and submodules are imported when first accessed"""
+
+    def __getattr__(self, name):
+        if name in _MODULES:
+            return importlib.import_module(self.__name__ + '.' + name)
+        module_name = _NAMES.get(name)
+        if module_name is None:
+            raise AttributeError('module {0!r} has no attribute {1!r}'.format(self.__name__, name))
+        value = getattr(importlib.import_module(self.__name__ + '.' + module_name), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | _MODULES | set(__all__))
+
+
+_module = LazyModule(__name__, __doc__)
+_module.__dict__.update(
+    (key, value) for key, value in globals().items()
+    if key in [ '__file__', '__path__', '__package__', '__all__' ]
+    )
+# Python 2 clears the globals of a module once it is garbage collected; the
+# methods above still need them
+_module._original = sys.modules[__name__]
+sys.modules[__name__] = _module
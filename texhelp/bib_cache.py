@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import hashlib
+import cPickle as pickle
+from collections import OrderedDict
+
+
+class CachedCitation(object):
+    """Formatted citation as stored in a CitationCache; offers parse() like BibCitation"""
+    __slots__ = ['citename', 'parsed', 'err_msgs', 'warning_msgs', 'records']
+
+    def __init__(self, citename, parsed, err_msgs, warning_msgs, records):
+        self.citename = citename
+        self.parsed = parsed
+        self.err_msgs = err_msgs
+        self.warning_msgs = warning_msgs
+        # (levelno, message) of everything that was logged while formatting
+        self.records = records
+
+    @classmethod
+    def from_citation(cls, citation, records):
+        return cls(
+            citation.citename, citation.parse(),
+            list(citation.err_msgs), list(citation.warning_msgs), list(records)
+            )
+
+    def parse(self):
+        return self.parsed
+
+    def replay(self):
+        for levelno, msg in self.records:
+            logging.log(levelno, msg)
+
+
+class CitationCache(object):
+    """
+    On-disk cache of formatted citations across runs.
+
+    Keys are hashes of the raw entry text plus the formatter settings and a
+    fingerprint of the rules and protected title words in use; values
+    are the parse() output, the CMS error and warning messages and the log
+    records of the entry. The whole cache is one pickle file that is read
+    once on construction and written by save(). When it holds more than
+    max_entries, the least recently used entries are dropped on save().
+    """
+
+    # Bump whenever a change to the formatter, outside of the rule checks,
+    # changes its output
+    version = 1
+
+    def __init__(self, path, max_entries=100000):
+        super(CitationCache, self).__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path): return
+        try:
+            with open(self.path, 'rb') as fp:
+                version, entries = pickle.load(fp)
+        except Exception as e:
+            logging.warning('Ignoring unreadable citation cache {0}: {1}'.format(self.path, e))
+            return
+        if version != self.version:
+            logging.info('Citation cache {0} is outdated; starting a new one'.format(self.path))
+            return
+        self.entries = entries
+
+    def save(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fp:
+            pickle.dump((self.version, self.entries), fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+        logging.info(
+            'Saved citation cache {0} ({1} entries; {2} hits, {3} misses this run)'
+            .format(self.path, len(self.entries), self.hits, self.misses)
+            )
+
+    def key(self, raw, cms_style, fingerprint=''):
+        if isinstance(raw, unicode): raw = raw.encode('utf-8')
+        return hashlib.sha1('cms_style={0}\0{1}\0{2}'.format(bool(cms_style), fingerprint, raw)).digest()
+
+    def get(self, key):
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        # Re-insert to mark as most recently used
+        self.entries[key] = value
+        self.hits += 1
+        return CachedCitation(*value)
+
+    def put(self, key, cached):
+        self.entries.pop(key, None)
+        self.entries[key] = (
+            cached.citename, cached.parsed, cached.err_msgs, cached.warning_msgs, cached.records
+            )
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+import re
+import zlib
+import random
+import logging
+from collections import OrderedDict
+
+from bib_formatter import CMSCiteFormatter
+
+#____________________________________________________________________
+# Duplicate and near-duplicate detection across bib entries
+
+_DOI_PREFIX_RE = re.compile(r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)', re.I)
+_EPRINT_PREFIX_RE = re.compile(r'^arxiv:\s*', re.I)
+_EPRINT_VERSION_RE = re.compile(r'v\d+$')
+_NON_ALNUM_RE = re.compile(r'[\W_]+', re.U)
+
+# Mersenne prime for the MinHash permutations (a*h + b) % _PRIME; small enough
+# that the products of 32 bit hashes stay machine integers
+_PRIME = (1 << 31) - 1
+
+
+def _strip_braces(value):
+    return value.replace('{', '').replace('}', '').strip()
+
+def normalize_doi(value):
+    return _DOI_PREFIX_RE.sub('', _strip_braces(value)).lower()
+
+def normalize_eprint(value):
+    return _EPRINT_VERSION_RE.sub('', _EPRINT_PREFIX_RE.sub('', _strip_braces(value)).lower())
+
+def normalize_report_number(value):
+    return _NON_ALNUM_RE.sub('', _strip_braces(value).lower())
+
+# Field -> normalization of the fields that identify a work exactly
+EXACT_KEYS = OrderedDict([
+    ('doi', normalize_doi),
+    ('eprint', normalize_eprint),
+    ('reportnumber', normalize_report_number),
+    ])
+
+# Fields of which a cluster may hold only one value
+CONFLICT_KEYS = [ 'doi', 'eprint' ]
+
+
+class UnionFind(object):
+    """Disjoint sets of the integers 0..n-1, with path halving and union by size"""
+
+    def __init__(self):
+        super(UnionFind, self).__init__()
+        self.parents = []
+        self.sizes = []
+
+    def add(self):
+        self.parents.append(len(self.parents))
+        self.sizes.append(1)
+        return len(self.parents) - 1
+
+    def find(self, i):
+        parents = self.parents
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i == j: return False
+        if self.sizes[i] < self.sizes[j]: i, j = j, i
+        self.parents[j] = i
+        self.sizes[i] += self.sizes[j]
+        return True
+
+
+class BibDeduplicator(object):
+    """
+    Clusters bib entries that describe the same work.
+
+    Entries are merged when they share a normalized doi, eprint or report
+    number, which is a dict lookup per entry. Titles, normalized with
+    get_reinterpreted_title, are compared through MinHash signatures of their
+    words: only entries that agree on all rows of one of bands bands become
+    candidates, and candidates are merged if the Jaccard similarity of their
+    words is at least threshold. Two clusters are never merged when they
+    hold different dois or eprints, also not through a third entry. Both
+    stages take time about linear in the number of entries.
+
+    After process, clusters lists the citenames of each cluster of more than
+    one entry, the first entry first; remapping maps every other citename of
+    a cluster to that first citename.
+    """
+
+    def __init__(self, threshold=0.8, bands=8, rows=4, seed=1):
+        super(BibDeduplicator, self).__init__()
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        rng = random.Random(seed)
+        self.permutations = [
+            (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for i in xrange(bands*rows)
+            ]
+        self.title_formatter = CMSCiteFormatter('@article{', {})
+
+        self.citenames = []
+        # Per entry: normalized exact keys, and the set of title words
+        self.exact_keys = []
+        self.title_words = []
+        self.union_find = UnionFind()
+        # Per cluster root: { field: value } of the CONFLICT_KEYS in the cluster
+        self.cluster_keys = []
+        # (field, normalized value) -> first entry with it
+        self.exact_index = {}
+        # Per band: band of the signature -> entries
+        self.buckets = [ {} for i in xrange(bands) ]
+        # (entry, entry) -> why they were merged
+        self.reasons = {}
+
+        self.clusters = []
+        self.remapping = OrderedDict()
+
+    def normalize_title(self, title):
+        title = self.title_formatter.get_reinterpreted_title(title)
+        return _NON_ALNUM_RE.sub(' ', title.lower()).split()
+
+    def get_signature(self, words):
+        hashes = [ zlib.crc32(word.encode('utf-8')) & 0xffffffff for word in words ]
+        return tuple( min([ (a*h + b) % _PRIME for h in hashes ]) for a, b in self.permutations )
+
+    def merge(self, i, j, reason):
+        root_i, root_j = self.union_find.find(i), self.union_find.find(j)
+        if root_i == root_j: return
+        keys_i, keys_j = self.cluster_keys[root_i], self.cluster_keys[root_j]
+        for field, value in keys_j.iteritems():
+            if keys_i.get(field, value) != value: return
+        self.union_find.union(root_i, root_j)
+        self.cluster_keys[self.union_find.find(root_i)] = dict(keys_i, **keys_j)
+        self.reasons[(i, j)] = reason
+
+    def add(self, citation):
+        """Indexes one BibCitation, merging it with the entries it duplicates"""
+        i = self.union_find.add()
+        self.citenames.append(citation.citename)
+        fields = dict( (key.lower(), value) for key, value in citation.fields.iteritems() )
+
+        exact_keys = {}
+        for field, normalize in EXACT_KEYS.iteritems():
+            if not field in fields: continue
+            value = normalize(fields[field])
+            if value: exact_keys[field] = value
+        self.exact_keys.append(exact_keys)
+        self.cluster_keys.append(
+            dict( (field, exact_keys[field]) for field in CONFLICT_KEYS if field in exact_keys )
+            )
+        for field in EXACT_KEYS:
+            if not field in exact_keys: continue
+            j = self.exact_index.setdefault((field, exact_keys[field]), i)
+            if j != i: self.merge(j, i, field)
+
+        title = fields.get('rawtitle', fields.get('title'))
+        words = frozenset(self.normalize_title(title)) if title else frozenset()
+        self.title_words.append(words)
+        if not words: return
+
+        signature = self.get_signature(words)
+        rows = self.rows
+        candidates = set()
+        for i_band, buckets in enumerate(self.buckets):
+            band = signature[i_band*rows:(i_band+1)*rows]
+            bucket = buckets.get(band)
+            if bucket is None:
+                buckets[band] = [ i ]
+            else:
+                candidates.update(bucket)
+                bucket.append(i)
+        for j in sorted(candidates):
+            if self.is_title_duplicate(j, i): self.merge(j, i, 'title')
+
+    def add_citations(self, citations):
+        for citation in citations:
+            self.add(citation)
+        return self
+
+    def iter_add(self, citations):
+        """Indexes citations while passing them on, to chain onto BibFormatter.iter_citations"""
+        for citation in citations:
+            self.add(citation)
+            yield citation
+
+    def is_title_duplicate(self, i, j):
+        words_i, words_j = self.title_words[i], self.title_words[j]
+        similarity = len(words_i & words_j) / float(len(words_i | words_j))
+        return similarity >= self.threshold
+
+    def process(self):
+        members = OrderedDict()
+        for i in xrange(len(self.citenames)):
+            members.setdefault(self.union_find.find(i), []).append(i)
+
+        self.clusters = []
+        self.remapping = OrderedDict()
+        for cluster in members.itervalues():
+            if len(cluster) == 1: continue
+            citenames = [ self.citenames[i] for i in cluster ]
+            self.clusters.append(citenames)
+            for citename in citenames[1:]:
+                if citename != citenames[0]: self.remapping[citename] = citenames[0]
+        logging.info(
+            'Found {0} clusters of duplicates among {1} entries'
+            .format(len(self.clusters), len(self.citenames))
+            )
+        return self
+
+    def get_reasons(self, citename):
+        """Why entries were merged into the cluster of citename, as (citename, citename, reason)"""
+        root = self.union_find.find(self.citenames.index(citename))
+        return [
+            (self.citenames[i], self.citenames[j], reason) for (i, j), reason in sorted(self.reasons.iteritems())
+            if self.union_find.find(i) == root
+            ]
+
+    def format_remapping(self):
+        """The remapping as lines of 'citename<tab>citename of the first entry'"""
+        return '\n'.join( '{0}\t{1}'.format(old, new) for old, new in self.remapping.iteritems() )
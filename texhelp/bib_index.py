@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import logging
+import hashlib
+import cPickle as pickle
+
+from bib_scanner import scan_bib
+
+#____________________________________________________________________
+# Persistent citename index for random access into bib files
+
+# Entry types that do not describe a citable work
+NON_CITATION_TYPES = set([ 'comment', 'string', 'preamble' ])
+
+
+def default_bib_index_path(bibfile):
+    bibfile = os.path.abspath(bibfile)
+    return os.path.join(os.path.dirname(bibfile), '.' + os.path.basename(bibfile) + '.texhelp_index')
+
+
+class BibIndex(object):
+    """
+    Maps the citenames of a bib file to the (offset, length, sha1 digest) of
+    their entries, so single entries can be read without reading the rest.
+
+    The bib file is memory-mapped. The index is stored at path (by default a
+    hidden file next to the bib file, None to keep it in memory only) and is
+    rebuilt whenever the bib file's mtime or size differs from what the index
+    was built from, or an entry does not match its digest.
+    """
+
+    # Bump whenever a change to the scanner changes the offsets
+    version = 2
+
+    def __init__(self, bibfile, path=False):
+        super(BibIndex, self).__init__()
+        self.bibfile = os.path.abspath(bibfile)
+        self.path = default_bib_index_path(bibfile) if path is False else path
+        # citename -> (offset, length, sha1 digest)
+        self.entries = {}
+        # citename -> offsets of the entries after the first with that citename
+        self.duplicates = {}
+        self.n_builds = 0
+        self._fp = None
+        self._mmap = None
+        self._stat = None
+        self.open()
+
+    #____________________________________________________________________
+    # Building, loading and saving
+
+    def open(self):
+        self.close()
+        self._fp = open(self.bibfile, 'rb')
+        st = os.fstat(self._fp.fileno())
+        self._stat = (st.st_mtime, st.st_size)
+        # Empty files cannot be mapped
+        self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else ''
+        if not self.load():
+            self.build()
+            self.save()
+
+    def close(self):
+        if self._mmap: self._mmap.close()
+        if self._fp: self._fp.close()
+        self._mmap = None
+        self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def load(self):
+        """Reads the stored index; returns False if there is none that fits the bib file"""
+        if self.path is None or not os.path.isfile(self.path): return False
+        try:
+            with open(self.path, 'rb') as fp:
+                state = pickle.load(fp)
+        except Exception as e:
+            logging.warning('Ignoring unreadable bib index {0}: {1}'.format(self.path, e))
+            return False
+        if state[0] != self.version or state[1] != self._stat: return False
+        version, stat, self.entries, self.duplicates = state
+        return True
+
+    def save(self):
+        if self.path is None: return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fp:
+            pickle.dump((self.version, self._stat, self.entries, self.duplicates), fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+    def build(self):
+        logging.debug('Building the citename index of {0}'.format(self.bibfile))
+        text = self._mmap
+        entries = {}
+        duplicates = {}
+        for i_begin, i_end, entry_type, open_tag in scan_bib(text):
+            if entry_type in NON_CITATION_TYPES: continue
+            i_name = i_begin + len(open_tag)
+            i_comma = text.find(',', i_name, i_end)
+            if i_comma == -1: continue
+            citename = text[i_name:i_comma].strip()
+            if citename in entries:
+                logging.warning(
+                    'Citename {0} occurs more than once in {1}; using the first entry'
+                    .format(citename, self.bibfile)
+                    )
+                duplicates.setdefault(citename, []).append(i_begin)
+                continue
+            entries[citename] = (i_begin, i_end - i_begin, hashlib.sha1(text[i_begin:i_end]).digest())
+        self.entries = entries
+        self.duplicates = duplicates
+        self.n_builds += 1
+
+    def refresh(self):
+        """Re-opens the bib file, rebuilding the index if the file changed"""
+        st = os.stat(self.bibfile)
+        if (st.st_mtime, st.st_size) != self._stat:
+            self.open()
+
+    #____________________________________________________________________
+    # Lookups
+
+    def __contains__(self, citename):
+        return citename in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_citenames(self):
+        return self.entries.keys()
+
+    def get_raw(self, citename):
+        """Returns the raw text of the entry of citename; raises KeyError if there is none"""
+        self.refresh()
+        offset, length, digest = self.entries[citename]
+        raw = self._mmap[offset:offset+length]
+        if hashlib.sha1(raw).digest() != digest:
+            # Changed without a change in mtime and size
+            self.build()
+            self.save()
+            offset, length, digest = self.entries[citename]
+            raw = self._mmap[offset:offset+length]
+        return raw
+
+    def get_citation(self, citename, formatter):
+        return formatter.get_citation(self.get_raw(citename))
+
+    def get_citations(self, citenames, formatter):
+        """
+        Returns a citename -> BibCitation dict of the citenames that are in the
+        index; only those entries are parsed
+        """
+        citations = {}
+        for citename in citenames:
+            if citename in self.entries and not citename in citations:
+                citations[citename] = self.get_citation(citename, formatter)
+        return citations
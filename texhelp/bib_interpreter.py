@@ -22,6 +22,8 @@ class StringBlock(geninterp.blocks.OpenCloseTagBlock):
         return text[i:i+len(cls.open_tag)].lower() == cls.open_tag.lower()
 
 
+_ENTRY_OPEN_RE = re.compile(r'@\w+\{')
+
 class EntryBlock(geninterp.blocks.OpenCloseTagBlock):
     name = 'entry'
     close_tag = '}'
@@ -29,7 +31,7 @@ class EntryBlock(geninterp.blocks.OpenCloseTagBlock):
 
     def __init__(self, i_begin, text):
         super(EntryBlock, self).__init__(i_begin, text)
-        match = re.match(r'@\w+\{', text[i_begin:i_begin+50])
+        match = _ENTRY_OPEN_RE.match(text, i_begin, i_begin+50)
         self.open_tag = match.group()
         self.entry_type = self.open_tag[1:-1].lower()
 
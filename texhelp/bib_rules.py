@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+import re
+import heapq
+import types
+import hashlib
+import logging
+from timeit import default_timer
+
+#____________________________________________________________________
+# Field-indexed rule engine for checking and correcting bib entries
+
+
+class RuleStats(object):
+    """Runs, hits and time spent of one rule, summed over all checked entries"""
+    __slots__ = ['runs', 'hits', 'time']
+
+    def __init__(self):
+        self.runs = 0
+        # Runs in which the rule flagged or changed something
+        self.hits = 0
+        self.time = 0.
+
+
+class Rule(object):
+    """
+    A check on the fields of an entry.
+
+    The check is called with the formatter whose fields are checked, and
+    returns True if it flagged or changed anything. It only runs if any of
+    fields is present; with fields=None it runs on every entry. adds lists the
+    fields the check may add, so that rules depending on them get to run
+    after it.
+    """
+    __slots__ = ['name', 'check', 'fields', 'adds', 'stats']
+
+    def __init__(self, name, check, fields=None, adds=()):
+        self.name = name
+        self.check = check
+        self.fields = None if fields is None else tuple(fields)
+        self.adds = tuple(adds)
+        self.stats = RuleStats()
+
+    def applies(self, fields):
+        if self.fields is None: return True
+        for field in self.fields:
+            if field in fields: return True
+        return False
+
+
+def update_code_digest(digest, code):
+    """Hashes the bytecode of code with its names and constants, which the bytecode only refers to"""
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            update_code_digest(digest, const)
+        else:
+            digest.update(repr(const))
+
+
+class RuleSet(object):
+    """
+    Rules in the order they are applied, indexed by the fields they depend on,
+    so that per entry only the rules of the fields that are present are
+    considered.
+    """
+
+    def __init__(self):
+        super(RuleSet, self).__init__()
+        self.rules = []
+        self.build_index()
+
+    def build_index(self):
+        # field -> indices of the rules depending on it
+        self.index = {}
+        # Indices of the rules that run on every entry
+        self.unconditional = []
+        for i_rule, rule in enumerate(self.rules):
+            if rule.fields is None:
+                self.unconditional.append(i_rule)
+            else:
+                for field in rule.fields:
+                    self.index.setdefault(field, []).append(i_rule)
+
+    def get_rule(self, name):
+        for rule in self.rules:
+            if rule.name == name: return rule
+        raise KeyError('No rule named {0}'.format(name))
+
+    def add(self, rule, before=None):
+        """Adds a Rule at the end, or in front of the rule named before"""
+        if before is None:
+            self.rules.append(rule)
+        else:
+            self.rules.insert(self.rules.index(self.get_rule(before)), rule)
+        self.build_index()
+        return rule
+
+    def remove(self, name):
+        self.rules.remove(self.get_rule(name))
+        self.build_index()
+
+    def register(self, name, fields=None, adds=(), before=None):
+        """Decorator that adds the decorated function as a Rule"""
+        def decorator(check):
+            self.add(Rule(name, check, fields, adds), before)
+            return check
+        return decorator
+
+    def fingerprint(self):
+        """Hash of the names, fields and code of the rules, in order; changes with the rule set"""
+        digest = hashlib.sha1()
+        for rule in self.rules:
+            digest.update(repr((
+                rule.name, rule.fields, rule.adds,
+                getattr(rule.check, '__module__', None), getattr(rule.check, '__name__', None)
+                )))
+            code = getattr(rule.check, '__code__', None)
+            if not(code is None): update_code_digest(digest, code)
+        return digest.hexdigest()
+
+    def apply(self, formatter):
+        """Runs the applicable rules on formatter.fields, in order"""
+        fields = formatter.fields
+        index = self.index
+        todo = list(self.unconditional)
+        for field in fields:
+            todo.extend(index.get(field, ()))
+        heapq.heapify(todo)
+
+        i_last = -1
+        while todo:
+            i_rule = heapq.heappop(todo)
+            if i_rule <= i_last: continue
+            i_last = i_rule
+            rule = self.rules[i_rule]
+            # An earlier rule may have removed the fields this one depends on
+            if not rule.applies(fields): continue
+
+            t_start = default_timer()
+            hit = rule.check(formatter)
+            stats = rule.stats
+            stats.time += default_timer() - t_start
+            stats.runs += 1
+            if hit: stats.hits += 1
+
+            for field in rule.adds:
+                if field in fields:
+                    for i_next in index.get(field, ()):
+                        if i_next > i_rule: heapq.heappush(todo, i_next)
+
+    def reset_stats(self):
+        for rule in self.rules:
+            rule.stats = RuleStats()
+
+    def format_stats(self):
+        lines = [ '{0:<32} {1:>9} {2:>9} {3:>10}'.format('rule', 'runs', 'hits', 'time [s]') ]
+        for rule in self.rules:
+            lines.append('{0:<32} {1:>9} {2:>9} {3:>10.4f}'.format(
+                rule.name, rule.stats.runs, rule.stats.hits, rule.stats.time
+                ))
+        return '\n'.join(lines)
+
+#____________________________________________________________________
+# The CMS conventions, in the order in which they are checked
+
+CMS_RULES = RuleSet()
+
+@CMS_RULES.register('year_missing')
+def check_year_missing(f):
+    if not 'year' in f.fields:
+        f.error('year field not given')
+        return True
+
+@CMS_RULES.register('href', fields=['href'])
+def check_href(f):
+    f.error(
+        'Found key \'href\' (=\"{0}\"), which should probably be replaced by \'url\''
+        .format(f.fields['href'])
+        )
+    return True
+
+@CMS_RULES.register('page_range', fields=['pages'])
+def check_page_range(f):
+    if '-' in f.fields['pages']:
+        f.warning('Correcting a range of pages: \"{0}\"'.format(f.fields['pages']))
+        f.fields['pages'] = f.fields['pages'].split('-')[0].strip()
+        return True
+
+@CMS_RULES.register('url_and_doi', fields=['url'])
+def check_url_and_doi(f):
+    if 'doi' in f.fields:
+        f.warning('Found a url key even though a doi is specified; Removing key url')
+        f.remove_key('url')
+        return True
+
+@CMS_RULES.register('doi_missing')
+def check_doi_missing(f):
+    if not 'doi' in f.fields:
+        f.warning('No doi field found')
+        return True
+
+@CMS_RULES.register('collaboration_keyword', fields=['collaboration'])
+def check_collaboration_keyword(f):
+    if 'collaboration' in f.fields['collaboration'].lower():
+        f.error(
+            'Found keyword \'collaboration\' in collaboration field,'
+            ' this should probably be removed: \"{0}\"'
+            .format(f.fields['collaboration'])
+            )
+        return True
+
+@CMS_RULES.register('pas', fields=['number', 'reportNumber', 'type'], adds=['type', 'number'])
+def check_pas(f):
+    if not f.is_a_pas(): return
+    if not 'type' in f.fields:
+        f.warning('Is a PAS, but no field \'type\' found. Adding type manually.')
+        f.keys.append('type')
+        f.fields['type'] = '{CMS Physics Analysis Summary}'
+
+    if f.entry_type != '@techreport{':
+        f.warning('Is a PAS, but not a @techreport. Chaning entry_type to techreport')
+        f.entry_type = '@techreport{'
+
+    if not 'number' in f.fields:
+        if 'reportNumber' in f.fields:
+            f.warning(
+                'Found no key \'number\', but found \'reportNumber\'; using that instead'
+                )
+            f.keys.append('number')
+            f.fields['number'] = f.fields['reportNumber']
+            f.remove_key('reportNumber')
+        else:
+            f.error(
+                'No key \'number\' or \'reportNumber\'; \'number\' should be specified!'
+                )
+    return True
+
+@CMS_RULES.register('title')
+def check_title(f):
+    if not 'title' in f.fields:
+        f.error('Found no key \'title\'.')
+        return True
+    optimized_title = f.get_reinterpreted_title(f.fields['title'])
+    if not f.fields['title'] == optimized_title:
+        logging.warning(
+            'Replacing title:\n'
+            'Old: \"{0}\"\nNew: \"{1}\"'
+            .format(f.fields['title'].encode('utf-8'), optimized_title.encode('utf-8'))
+            )
+        if not 'rawtitle' in f.fields:
+            f.keys.append('rawtitle')
+            f.fields['rawtitle'] = f.fields['title']
+        f.fields['title'] = optimized_title
+        return True
+
+_VOLUME_LETTER_RE = re.compile(r'([a-zA-Z])')
+
+@CMS_RULES.register('volume_letter', fields=['volume'])
+def check_volume_letter(f):
+    if not 'journal' in f.fields: return
+    match = _VOLUME_LETTER_RE.match(f.fields['volume'][0])
+    if match:
+        vol_letter = match.group(1)
+        new_journal_name = f.fields['journal'].strip() + ' ' + vol_letter.upper()
+        f.warning(
+            'Detected a volume starting with a letter: {0}; '
+            'changing journal from "{1}" to "{2}"'
+            .format(f.fields['volume'], f.fields['journal'], new_journal_name)
+            )
+        f.fields['journal'] = new_journal_name
+        f.fields['volume'] = f.fields['volume'][1:]
+        return True
+
+@CMS_RULES.register('number', fields=['number'])
+def check_number(f):
+    if not f.is_a_pas():
+        logging.warning('Removing \'number\' key: {0}'.format(f.fields['number']))
+        f.remove_key('number')
+        return True
+
+@CMS_RULES.register('type_brackets', fields=['type'])
+def check_type_brackets(f):
+    hit = False
+    if not(f.fields['type'].startswith('{')):
+        f.warning('Adding opening bracket to type field')
+        f.fields['type'] = '{' + f.fields['type']
+        hit = True
+    if not(f.fields['type'].endswith('}')):
+        f.warning('Adding closing bracket to type field')
+        f.fields['type'] += '}'
+        hit = True
+    return hit
+
+@CMS_RULES.register('atlas_and_cms', fields=['collaboration'], adds=['author'])
+def check_atlas_and_cms(f):
+    collaboration = f.fields['collaboration'].lower()
+    if 'atlas' in collaboration and 'cms' in collaboration:
+        f.warning(
+            'Detected ATLAS and CMS in the collaboration field; '
+            'Putting \'{ATLAS and CMS Collaborations}\' in the '
+            'author field instead.'
+            )
+        if not 'author' in f.fields: f.keys.append('author')
+        f.fields['author'] = '{ATLAS and CMS Collaborations}'
+        f.remove_key('collaboration')
+        return True
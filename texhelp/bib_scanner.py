@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+#____________________________________________________________________
+# Single-pass scanner for bib files
+
+# A double quoted string; any character directly preceded by a backslash is
+# escaped, so an escaped quote does not end the string
+_STRING = r'"[^"\\]*(?:\\+[^\\][^"\\]*)*"'
+
+# Every token the scanner reacts to, in one alternation. A bare double quote
+# only matches when its string is not terminated.
+_TOKEN_RE = re.compile(_STRING + r'|@(\w+)\{|[{}"]')
+
+# Fast path: a complete entry without braces outside of its strings, which
+# is what nearly all INSPIRE entries look like
+_FLAT_ENTRY_RE = re.compile(
+    r'@(\w+)\{[^"{}\\]*(?:(?:\\+[^\\]|' + _STRING + r')[^"{}\\]*)*\}'
+    )
+
+
+def _scan(text, pos=0, final=True):
+    """
+    Scans text from pos on and returns (spans, stop). Entries that are not
+    complete yet are only an error if final is True; otherwise stop is the
+    index from which scanning should resume once more text is available.
+    """
+    spans = []
+    depth = 0
+    i_begin = None
+    entry_type = None
+    open_tag = None
+
+    search = _TOKEN_RE.search
+    match_flat_entry = _FLAT_ENTRY_RE.match
+    while True:
+        match = search(text, pos)
+        if match is None: break
+        start = match.start()
+        if start > 0 and text[start-1] == '\\':
+            # Escaped token; resume right after the escaped character
+            pos = start + 1
+            continue
+        token = match.group()
+        if token == '"':
+            # Unterminated string; it runs to the end of the text
+            if final: break
+            return spans, (start if depth == 0 else i_begin)
+        pos = match.end()
+        if token[0] == '"':
+            # Strings are consumed as a whole
+            pass
+        elif token == '}':
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    spans.append((i_begin, pos, entry_type, open_tag))
+        elif token == '{':
+            if depth > 0: depth += 1
+        elif depth > 0:
+            # '@type{' inside an entry only counts as an opening brace
+            depth += 1
+        else:
+            entry_type = match.group(1).lower()
+            open_tag = token
+            flat_entry = match_flat_entry(text, start)
+            if flat_entry:
+                pos = flat_entry.end()
+                spans.append((start, pos, entry_type, open_tag))
+            else:
+                depth = 1
+                i_begin = start
+
+    if depth > 0:
+        if final:
+            raise ValueError(
+                'Unterminated bib entry starting at index {0}: {1}'
+                .format(i_begin, text[i_begin:i_begin+50])
+                )
+        return spans, i_begin
+    # An '@' after the last token may be the start of an entry opener that
+    # is cut off at the end of the text
+    i_at = text.rfind('@', pos)
+    return spans, (len(text) if i_at == -1 else i_at)
+
+
+def scan_bib(text):
+    """
+    Finds all entries in a bib text in a single regex-driven pass.
+
+    Returns a list of (i_begin, i_end, entry_type, open_tag) tuples, where
+    text[i_begin:i_end] is the full entry including '@type{' and the closing
+    brace. Double quotes outside and inside entries open strings in which no
+    tokens are recognized, and a token directly preceded by a backslash is
+    ignored, the same way StringBlock and EntryBlock do in BibInterpreter.
+    Braces are matched, so '{...}'-delimited values do not end an entry early.
+    """
+    return _scan(text)[0]
+
+
+def iter_bib_entries(bibfile, chunk_size=1<<20, formatter=None, spans=False):
+    """
+    Yields the raw text of every entry in a bib file as soon as its closing
+    brace has been read, or the BibCitation made by formatter.get_citation
+    if a formatter is given. With spans=True, (buffer, i_begin, i_end) is
+    yielded instead of the raw text, so that the entry is not copied out of
+    the buffer it was read into.
+
+    bibfile is a path or an open file object. The file is read in chunks of
+    chunk_size characters; only the unfinished tail of the previous chunk is
+    kept in memory, so memory stays flat for arbitrarily large files.
+    """
+    if isinstance(bibfile, basestring):
+        with open(bibfile, 'r') as fp:
+            for entry in iter_bib_entries(fp, chunk_size, formatter, spans):
+                yield entry
+        return
+
+    buf = ''
+    pos = 0
+    while True:
+        chunk = bibfile.read(chunk_size)
+        final = not chunk
+        buf += chunk
+        entry_spans, stop = _scan(buf, pos, final)
+        for i_begin, i_end, entry_type, open_tag in entry_spans:
+            if not(formatter is None):
+                yield formatter.get_citation(buf, i_begin, i_end)
+            elif spans:
+                yield buf, i_begin, i_end
+            else:
+                yield buf[i_begin:i_end]
+        if final: break
+        # Keep one character in front of stop, for the escape rule
+        keep = max(stop - 1, 0)
+        buf = buf[keep:]
+        pos = stop - keep
+
+
+class ScannedEntryBlock(object):
+    """Offsets of one entry in the scanned text; mimics EntryBlock"""
+    name = 'entry'
+
+    def __init__(self, text, i_begin, i_end, entry_type, open_tag):
+        super(ScannedEntryBlock, self).__init__()
+        self.text = text
+        self.i_begin = i_begin
+        self.i_end = i_end
+        self.entry_type = entry_type
+        self.open_tag = open_tag
+        self.close_tag = '}'
+
+    def get_text(self):
+        return self.text[self.i_begin:self.i_end]
+
+    def get_text_no_tags(self):
+        return self.text[self.i_begin+len(self.open_tag):self.i_end-len(self.close_tag)]
+
+
+class ScannedNode(object):
+    """Tree node holding a single block, like the nodes of a geninterp tree"""
+
+    def __init__(self, block):
+        super(ScannedNode, self).__init__()
+        self.block = block
+
+
+class ScannedBibTree(object):
+    """Flat tree of entries; supports the queries used on BibInterpreter trees"""
+
+    def __init__(self, text, nodes):
+        super(ScannedBibTree, self).__init__()
+        self.text = text
+        self.nodes = nodes
+
+    def gen_blocks_by_name(self, name):
+        for node in self.nodes:
+            if node.block.name == name:
+                yield node
+
+    def parse(self):
+        # Bib blocks never rewrite their text
+        return self.text
+
+
+class BibScanner(object):
+    """
+    Drop-in replacement for BibInterpreter based on scan_bib.
+
+    Only 'entry' blocks are recorded; strings are consumed during the scan
+    but do not end up in the tree.
+    """
+
+    def interpret(self, text):
+        nodes = [
+            ScannedNode(ScannedEntryBlock(text, i_begin, i_end, entry_type, open_tag))
+            for i_begin, i_end, entry_type, open_tag in scan_bib(text)
+            ]
+        return ScannedBibTree(text, nodes)
+
+    def interpret_file(self, bibfile):
+        with open(bibfile, 'r') as fp:
+            text = fp.read()
+        return self.interpret(text)
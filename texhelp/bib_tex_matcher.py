@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import re
+from collections import OrderedDict
+
+from bib_formatter import BibFormatter
+from bib_index import NON_CITATION_TYPES
+
+#____________________________________________________________________
+# Matching the cite keys of tex files to the entries of bib files
+
+# A comment inside a \cite{...}, up to and including its line break
+_COMMENT_RE = re.compile(r'(?<!\\)%[^\n]*\n?')
+# Entry type and citename at the start of a raw bib entry
+_CITENAME_RE = re.compile(r'\s*@(\w+)\s*\{\s*([^,\s]*)\s*,')
+
+
+def split_cite_keys(text):
+    """Returns the keys of the argument of a \\cite, e.g. 'a, b,c' -> ['a', 'b', 'c']"""
+    if '%' in text: text = _COMMENT_RE.sub('', text)
+    return [ key.strip() for key in text.split(',') if key.strip() ]
+
+
+class BibTexMatcher(object):
+    """
+    Reconciles the \\cite keys of tex documents with the citenames of bib files.
+
+    tex_trees are TexInterpreter trees, or TexProjects; bib_trees are
+    BibInterpreter or BibScanner trees, or BibIndexes. Cites and bib entries
+    are collected into dicts in one pass each, so finding missing, unused and
+    duplicate keys takes time linear in the number of cites and entries.
+    tex_names and bib_names label the trees in the summaries.
+    """
+
+    def __init__(self, tex_trees, bib_trees, tex_names=None, bib_names=None):
+        super(BibTexMatcher, self).__init__()
+        self.tex_trees = tex_trees
+        self.bib_trees = bib_trees
+        self.tex_names = tex_names
+        self.bib_names = bib_names
+        # Used to parse matched entries with get_citation
+        self.bib_formatter = BibFormatter(cms_style=True)
+
+        # Cite key -> [ (tex name, offset) ], in order of first citation
+        self.cites = OrderedDict()
+        self.n_cite_commands = 0
+        # Citename -> [ (bib name, offset, bib tree) ], in order of appearance
+        self.bib_entries = OrderedDict()
+
+        self.missing = []
+        self.unused = []
+        self.duplicates = []
+
+    def get_name(self, names, i, default):
+        if names is None or i >= len(names): return '{0} {1}'.format(default, i)
+        return names[i]
+
+    #____________________________________________________________________
+    # Collecting
+
+    def gen_cite_texts(self, tree):
+        """Yields (argument of a \\cite, tex file or None, offset) for one tex tree"""
+        if hasattr(tree, 'gen_records'):
+            for node, record in tree.gen_records('cite'):
+                yield record[3], node.path, record[1]
+        else:
+            for node in tree.gen_blocks_by_name('cite'):
+                yield node.block.get_text_no_tags(), getattr(node.block, 'path', None), node.block.i_begin
+
+    def gen_bib_entries(self, tree):
+        """Yields (citename, offset) for one bib tree or index"""
+        if hasattr(tree, 'get_citenames'):
+            for citename, (offset, length, digest) in tree.entries.iteritems():
+                yield citename, offset
+            for citename, offsets in tree.duplicates.iteritems():
+                for offset in offsets:
+                    yield citename, offset
+            return
+        for node in tree.gen_blocks_by_name('entry'):
+            block = node.block
+            if block.entry_type in NON_CITATION_TYPES: continue
+            match = _CITENAME_RE.match(block.get_text())
+            if match is None: continue
+            yield match.group(2), block.i_begin
+
+    def collect(self):
+        cites = self.cites
+        for i_tree, tree in enumerate(self.tex_trees):
+            tex_name = self.get_name(self.tex_names, i_tree, 'tex tree')
+            for text, path, offset in self.gen_cite_texts(tree):
+                self.n_cite_commands += 1
+                location = (tex_name if path is None else path, offset)
+                for key in split_cite_keys(text):
+                    locations = cites.get(key)
+                    if locations is None:
+                        cites[key] = [ location ]
+                    else:
+                        locations.append(location)
+
+        bib_entries = self.bib_entries
+        for i_tree, tree in enumerate(self.bib_trees):
+            bib_name = self.get_name(self.bib_names, i_tree, 'bib tree')
+            entries = sorted(self.gen_bib_entries(tree), key=lambda entry: entry[1])
+            for citename, offset in entries:
+                location = (bib_name, offset, tree)
+                locations = bib_entries.get(citename)
+                if locations is None:
+                    bib_entries[citename] = [ location ]
+                else:
+                    locations.append(location)
+
+    def process(self):
+        self.collect()
+        self.missing = [ key for key in self.cites if not key in self.bib_entries ]
+        self.unused = [ citename for citename in self.bib_entries if not citename in self.cites ]
+        self.duplicates = [
+            citename for citename, locations in self.bib_entries.iteritems() if len(locations) > 1
+            ]
+        return self
+
+    #____________________________________________________________________
+    # Results
+
+    def get_raw(self, citename):
+        """Raw text of the first bib entry of citename"""
+        bib_name, offset, tree = self.bib_entries[citename][0]
+        if hasattr(tree, 'get_raw'):
+            return tree.get_raw(citename)
+        for node in tree.gen_blocks_by_name('entry'):
+            if node.block.i_begin == offset:
+                return node.block.get_text()
+
+    def get_citation(self, citename):
+        return self.bib_formatter.get_citation(self.get_raw(citename))
+
+    def format_location(self, location):
+        return '{0}:{1}'.format(location[0], location[1])
+
+    def show_summary_tex_only_plain(self):
+        for key in self.cites:
+            print key
+
+    def show_summary_tex_only(self):
+        print 'Found {0} unique cite keys in {1} \\cite commands:'.format(
+            len(self.cites), self.n_cite_commands
+            )
+        for key, locations in self.cites.iteritems():
+            print '    {0:40} {1:3}x  first at {2}'.format(
+                key, len(locations), self.format_location(locations[0])
+                )
+
+    def show_summary(self):
+        print 'Found {0} unique cite keys in {1} \\cite commands, and {2} citenames in {3} bib files'.format(
+            len(self.cites), self.n_cite_commands, len(self.bib_entries), len(self.bib_trees)
+            )
+
+        print 'Cite keys without a bib entry ({0}):'.format(len(self.missing))
+        for key in self.missing:
+            print '    {0:40} cited at {1}'.format(
+                key, ', '.join( self.format_location(location) for location in self.cites[key] )
+                )
+
+        print 'Bib entries that are never cited ({0}):'.format(len(self.unused))
+        for citename in self.unused:
+            print '    {0:40} at {1}'.format(citename, self.format_location(self.bib_entries[citename][0]))
+
+        print 'Citenames with more than one bib entry ({0}):'.format(len(self.duplicates))
+        for citename in self.duplicates:
+            print '    {0:40} at {1}'.format(
+                citename, ', '.join( self.format_location(location) for location in self.bib_entries[citename] )
+                )
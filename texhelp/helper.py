@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import os
+from bisect import bisect_right
+from tex_index import open_project
+from img_inventory import ImageInventory, ImageReconciler
+
+
+class Helper(object):
+    """Figure, image and input overviews of a tex file and everything it includes"""
+
+    def __init__(self, texfile, use_index=False):
+        super(Helper, self).__init__()
+        self.texfile = texfile
+        self.project = open_project(texfile, persistent=use_index)
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.project.root_dir)
+
+    def get_images(self):
+        return [ record[3] for node, record in self.project.gen_records('includegraphics') ]
+
+    def print_images(self):
+        for image in self.get_images():
+            print image
+
+    def print_inputs(self):
+        for node in self.project.gen_nodes():
+            print '    ' * node.depth() + self.relpath(node.path)
+
+    def print_figures(self, print_captions=False):
+        # Per file, the (i_begin list, records) that can be inside a figure
+        figure_contents = {}
+        i_figure = 0
+        for node, figure in self.project.gen_records('figure'):
+            i_figure += 1
+            print 'Figure {0} ({1})'.format(i_figure, self.relpath(node.path))
+            contents = figure_contents.get(node.path)
+            if contents is None:
+                records = list(node.scan.gen_records('includegraphics', 'label', 'caption'))
+                contents = figure_contents[node.path] = ([ record[1] for record in records ], records)
+            i_begins, records = contents
+            for i in xrange(bisect_right(i_begins, figure[1]), len(records)):
+                name, i_begin, i_end, arg = records[i]
+                if i_begin >= figure[2]: break
+                if name == 'includegraphics':
+                    print '    ' + arg
+                elif name == 'label':
+                    print '    label: ' + arg
+                elif name == 'caption' and print_captions:
+                    print '    caption: ' + arg
+
+    def reconcile_images(self, imgdir):
+        """Returns the ImageReconciler of the \\includegraphics of the project and the images in imgdir"""
+        inventory = ImageInventory(imgdir)
+        return ImageReconciler(self.project, inventory, self.project.root_dir).process()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+from time import strftime
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+#____________________________________________________________________
+# Inventory of the images in a directory, reconciled with \includegraphics
+
+# Extensions tried for an \includegraphics without one, in the order of pdflatex
+IMAGE_EXTENSIONS = [ '.pdf', '.png', '.jpg', '.jpeg', '.eps' ]
+
+
+def normalize_path(path):
+    return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+
+def _walk_scandir(directory):
+    stack = [ directory ]
+    while stack:
+        try:
+            entries = scandir(stack.pop())
+        except OSError as e:
+            logging.warning('Cannot list {0}: {1}'.format(e.filename, e.strerror))
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+def _walk_listdir(directory):
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            yield os.path.join(dirpath, filename)
+
+def iter_files(directory):
+    """Yields the paths of all files under directory"""
+    if scandir is None:
+        return _walk_listdir(directory)
+    return _walk_scandir(directory)
+
+
+class ImageInventory(object):
+    """
+    The image files under a directory, indexed by normalized path with and
+    without extension, so that resolving an \\includegraphics argument takes
+    a few dict lookups instead of a pass over all files.
+    """
+
+    def __init__(self, imgdir, extensions=None):
+        super(ImageInventory, self).__init__()
+        self.imgdir = imgdir
+        self.extensions = IMAGE_EXTENSIONS if extensions is None else extensions
+        # normalized path -> path as found on disk
+        self.files = {}
+        # normalized path without extension -> { lowercase extension: path }
+        self.stems = {}
+        self.scan()
+
+    def scan(self):
+        extensions = set(self.extensions)
+        files = {}
+        stems = {}
+        if os.path.isdir(self.imgdir):
+            for path in iter_files(self.imgdir):
+                stem, ext = os.path.splitext(path)
+                ext = ext.lower()
+                if not ext in extensions: continue
+                files[normalize_path(path)] = path
+                stems.setdefault(normalize_path(stem), {})[ext] = path
+        self.files = files
+        self.stems = stems
+
+    def __len__(self):
+        return len(self.files)
+
+    def lookup(self, path):
+        """
+        Returns the image file a (extension-less) path refers to, or None.
+        Without a known extension the extensions are tried in order.
+        """
+        normalized = normalize_path(path)
+        if os.path.splitext(path)[1].lower() in self.extensions:
+            return self.files.get(normalized)
+        by_ext = self.stems.get(normalized)
+        if by_ext is None: return None
+        for ext in self.extensions:
+            if ext in by_ext: return by_ext[ext]
+        return None
+
+
+def resolve_image(inventory, arg, search_dirs):
+    """
+    Returns the file an \\includegraphics argument refers to, or None.
+    Files outside of the inventory's directory are looked up on disk.
+    """
+    for search_dir in search_dirs:
+        candidate = os.path.join(search_dir, arg)
+        path = inventory.lookup(candidate)
+        if not(path is None): return path
+        if os.path.splitext(candidate)[1].lower() in inventory.extensions:
+            if os.path.isfile(candidate): return candidate
+        else:
+            for ext in inventory.extensions:
+                if os.path.isfile(candidate + ext): return candidate + ext
+    return None
+
+
+def gen_image_refs(tree, base_dir):
+    """
+    Yields (\\includegraphics argument, search dirs) for a TexProject or a
+    TexInterpreter tree; base_dir is the directory the tex file is compiled from.
+    """
+    if hasattr(tree, 'gen_records'):
+        for node, record in tree.gen_records('includegraphics'):
+            if node.import_dir == '.':
+                yield record[3], [ base_dir ]
+            else:
+                yield record[3], [ os.path.join(base_dir, node.import_dir), base_dir ]
+    else:
+        for node in tree.gen_blocks_by_name('includegraphics'):
+            yield node.block.get_text_no_tags().strip(), [ base_dir ]
+
+
+class ImageReconciler(object):
+    """Sorts the images of a tex tree and of an ImageInventory in used, missing and unused"""
+
+    def __init__(self, tree, inventory, base_dir):
+        super(ImageReconciler, self).__init__()
+        self.tree = tree
+        self.inventory = inventory
+        self.base_dir = base_dir
+        # (argument, file) of \includegraphics that resolve to a file
+        self.found = []
+        # Arguments of \includegraphics that resolve to no file
+        self.missing = []
+        # Files in the inventory that no \includegraphics refers to
+        self.unused = []
+
+    def process(self):
+        used = set()
+        for arg, search_dirs in gen_image_refs(self.tree, self.base_dir):
+            path = resolve_image(self.inventory, arg, search_dirs)
+            if path is None:
+                self.missing.append(arg)
+            else:
+                self.found.append((arg, path))
+                used.add(normalize_path(path))
+        self.unused = sorted(
+            path for normalized, path in self.inventory.files.iteritems() if not normalized in used
+            )
+        return self
+
+
+def archive_images(paths, base_dir, archive_dir=None, dryrun=False, batch_size=500):
+    """
+    Moves paths into archive_dir (by default a timestamped directory in
+    base_dir), keeping their directory structure relative to base_dir.
+    Destination directories are created once per batch rather than per file.
+    Returns the list of (src, dst) moves.
+    """
+    if archive_dir is None:
+        archive_dir = os.path.join(base_dir, 'archive_img_{0}'.format(strftime('%Y%m%d_%H%M%S')))
+
+    moves = []
+    for path in paths:
+        relpath = os.path.relpath(os.path.abspath(path), base_dir)
+        if relpath.startswith(os.pardir): relpath = os.path.abspath(path).lstrip(os.sep)
+        moves.append((path, os.path.join(archive_dir, relpath)))
+
+    for i_batch in xrange(0, len(moves), batch_size):
+        batch = moves[i_batch:i_batch+batch_size]
+        if dryrun:
+            for src, dst in batch:
+                print 'Moving {0} to {1}'.format(src, dst)
+            continue
+        for dst_dir in set( os.path.dirname(dst) for src, dst in batch ):
+            if not os.path.isdir(dst_dir): os.makedirs(dst_dir)
+        for src, dst in batch:
+            os.rename(src, dst)
+        logging.info('Archived {0}/{1} images'.format(i_batch + len(batch), len(moves)))
+    return moves
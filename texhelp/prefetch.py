@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from tex_scanner import scan_tex, INCLUDE_DIRECTIVES
+
+#____________________________________________________________________
+# Reading the files of an include tree ahead of the parser
+
+
+def read_file(path):
+    with open(path, 'r') as fp:
+        return fp.read()
+
+
+class Prefetcher(object):
+    """
+    Reads the files of an include tree on a pool of threads, so that slow
+    opens (e.g. on networked file systems) overlap instead of adding up.
+
+    Every file is scanned as soon as it is read, and the files it includes
+    are queued right away. The parser then picks up the (text, TexScan) of
+    a file with get; files that were not prefetched are read on the spot,
+    so the result never depends on what was prefetched.
+    """
+
+    def __init__(self, workers=8, read=None):
+        super(Prefetcher, self).__init__()
+        self.read = read_file if read is None else read
+        self.pool = ThreadPool(workers)
+        self.lock = threading.Lock()
+        # path -> AsyncResult of (text, TexScan)
+        self.results = {}
+        self.resolve = None
+        self.get_cached_scan = None
+
+    def start(self, path, resolve, get_cached_scan=None):
+        """
+        Starts reading path and everything it includes. resolve(record,
+        import_dir) returns the (path, import_dir) an include record pulls
+        in; get_cached_scan(path) returns a TexScan for files that need not
+        be read, or None.
+        """
+        self.resolve = resolve
+        self.get_cached_scan = get_cached_scan
+        self.prefetch(path, '.')
+        return self
+
+    def prefetch(self, path, import_dir):
+        with self.lock:
+            if path in self.results: return
+            self.results[path] = self.pool.apply_async(self.fetch, (path, import_dir))
+
+    def fetch(self, path, import_dir):
+        # Includes are resolved speculatively; the parser reports missing files
+        if not os.path.isfile(path): return None, None
+        text = None
+        scan = None if self.get_cached_scan is None else self.get_cached_scan(path)
+        if scan is None:
+            text = self.read(path)
+            scan = scan_tex(text)
+        for record in scan.gen_records(*INCLUDE_DIRECTIVES):
+            self.prefetch(*self.resolve(record, import_dir))
+        return text, scan
+
+    def get(self, path):
+        """
+        Returns (text, TexScan or None) of path, waiting for a prefetch that
+        is under way; errors of the read are raised here
+        """
+        with self.lock:
+            # A path that is not queued yet is read here, and never prefetched
+            result = self.results.setdefault(path, None)
+        if not(result is None):
+            text, scan = result.get()
+            if not(text is None): return text, scan
+        return self.read(path), None
+
+    def wait(self, path):
+        """Waits for the prefetch of path, if any, ignoring its errors"""
+        with self.lock:
+            result = self.results.get(path)
+        if not(result is None): result.wait()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
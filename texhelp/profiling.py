@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import atexit
+import cProfile
+from timeit import default_timer
+
+#____________________________________________________________________
+# Per-stage, per-block and per-file timing of the texhelp hot paths
+
+def get_stages():
+    """(stage, owner, attribute, whether the first argument is a file path) of the instrumented stages"""
+    # Imported here rather than at the top, so that scripts that only add
+    # the profiling options do not load the parsers
+    import geninterp
+    import bib_scanner
+    import bib_formatter
+    import tex_index
+    return [
+        ('tree building', geninterp.Interpreter, 'interpret_file', True),
+        ('tree building', geninterp.Interpreter, 'interpret', False),
+        ('bib scanning', bib_scanner.BibScanner, 'interpret_file', True),
+        ('bib scanning', bib_scanner, '_scan', False),
+        ('tex scanning', tex_index.TexIndex, 'get_scan', True),
+        ('tex scanning', tex_index, 'scan_tex', False),
+        ('citation formatting', bib_formatter.BibFormatter, 'get_citation', False),
+        ('field splitting', bib_formatter, 'split_fields', False),
+        ('CMS checks', bib_formatter.CMSCiteFormatter, 'check_fields', False),
+        ('title reinterpretation', bib_formatter.CMSCiteFormatter, 'get_reinterpreted_title', False),
+        ]
+
+# Block methods whose time is attributed to the block type. open is left
+# alone; it is called for every block type at every index, so wrapping it
+# would cost more than what it measures.
+BLOCK_METHODS = [ '__init__', 'advance_index_at_open', 'process' ]
+
+def get_block_classes():
+    import tex_interpreter
+    import bib_interpreter
+    return tex_interpreter.TexInterpreter.blocks + bib_interpreter.BibInterpreter.blocks
+
+
+class Timing(object):
+    """Call count, inclusive and exclusive time of one instrumented category"""
+    __slots__ = ['calls', 'total', 'own']
+
+    def __init__(self):
+        self.calls = 0
+        # Time of the outermost calls, including nested instrumented calls
+        self.total = 0.
+        # Time excluding nested instrumented calls
+        self.own = 0.
+
+
+class Profiler(object):
+    """
+    Wraps the texhelp hot paths to measure where the time of a run goes.
+
+    Timings are kept per stage (tree building, field splitting, ...), per
+    block type and per parsed file. If dump is given, the run is also
+    profiled with cProfile and the stats are written to that path.
+    """
+
+    def __init__(self, dump=None, stream=None):
+        super(Profiler, self).__init__()
+        self.dump = dump
+        self.stream = sys.stderr if stream is None else stream
+        self.stages = {}
+        self.blocks = {}
+        # Block name -> number of blocks created
+        self.block_counts = {}
+        self.files = {}
+        # [(table, category) pairs, t_start, time in nested frames], where
+        # table is 'stages', 'blocks' or 'files'
+        self._frames = []
+        # (table, category) -> number of open frames
+        self._depths = {}
+        # (owner, attribute, original value in owner.__dict__ or None)
+        self._patches = []
+        self._cprofile = None
+        self.t_start = None
+        self.t_stop = None
+
+    #____________________________________________________________________
+    # Bookkeeping
+
+    def _enter(self, categories):
+        for key in categories:
+            self._depths[key] = self._depths.get(key, 0) + 1
+        self._frames.append([categories, default_timer(), 0.])
+
+    def _exit(self):
+        categories, t_start, t_nested = self._frames.pop()
+        elapsed = default_timer() - t_start
+        if self._frames: self._frames[-1][2] += elapsed
+
+        for key in categories:
+            table, category = key
+            self._depths[key] -= 1
+            timings = getattr(self, table)
+            timing = timings.get(category)
+            if timing is None:
+                timing = timings[category] = Timing()
+            timing.calls += 1
+            timing.own += elapsed - t_nested
+            if self._depths[key] == 0:
+                timing.total += elapsed
+
+    def _wrap(self, owner, attribute, get_categories):
+        """
+        Replaces owner.attribute by a timed version. get_categories gets the
+        call arguments and returns the (table, category) pairs to credit;
+        calls for which it returns nothing are not timed.
+        """
+        original = getattr(owner, attribute, None)
+        if original is None: return
+        profiler = self
+
+        def wrapper(*args, **kwargs):
+            categories = get_categories(args)
+            if not categories: return original(*args, **kwargs)
+            profiler._enter(categories)
+            try:
+                return original(*args, **kwargs)
+            finally:
+                profiler._exit()
+
+        wrapper.__name__ = attribute
+        wrapper.__doc__ = getattr(original, '__doc__', None)
+        self._patches.append((owner, attribute, owner.__dict__.get(attribute)))
+        setattr(owner, attribute, wrapper)
+
+    def instrument_stage(self, stage, owner, attribute, takes_path=False):
+        i_path = 1 if isinstance(owner, type) else 0
+        def get_categories(args):
+            categories = [ ('stages', stage) ]
+            if takes_path and len(args) > i_path and isinstance(args[i_path], basestring):
+                categories.append(('files', args[i_path]))
+            return categories
+        self._wrap(owner, attribute, get_categories)
+
+    def instrument_block(self, block_class):
+        def get_categories(args):
+            # Calls through super() from a subclass are timed by the subclass
+            if type(args[0]) is block_class: return [ ('blocks', block_class.name) ]
+        def get_categories_init(args):
+            categories = get_categories(args)
+            if categories:
+                self.block_counts[block_class.name] = self.block_counts.get(block_class.name, 0) + 1
+            return categories
+        for method in BLOCK_METHODS:
+            self._wrap(block_class, method, get_categories_init if method == '__init__' else get_categories)
+        if hasattr(block_class, 'run_subinterpreter'):
+            self._wrap(
+                block_class, 'run_subinterpreter',
+                lambda args: [ ('stages', 'sub-interpreter recursion') ]
+                )
+
+    #____________________________________________________________________
+    # Starting and stopping
+
+    def start(self, block_classes=None):
+        for stage, owner, attribute, takes_path in get_stages():
+            self.instrument_stage(stage, owner, attribute, takes_path)
+        for block_class in (get_block_classes() if block_classes is None else block_classes):
+            self.instrument_block(block_class)
+        if self.dump:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self.t_start = default_timer()
+        return self
+
+    def stop(self, report=True):
+        if self.t_start is None or not(self.t_stop is None): return
+        self.t_stop = default_timer()
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.dump)
+        for owner, attribute, original in reversed(self._patches):
+            if original is None:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+        self._patches = []
+        if report: self.print_report()
+
+    #____________________________________________________________________
+    # Reporting
+
+    def format_table(self, title, timings, counts=None):
+        lines = [ '{0:<40} {1:>9} {2:>10} {3:>10}'.format(
+            title, 'calls' if counts is None else 'count', 'total [s]', 'own [s]'
+            ) ]
+        for category, timing in sorted(timings.items(), key=lambda item: -item[1].total):
+            lines.append('    {0:<36} {1:>9} {2:>10.4f} {3:>10.4f}'.format(
+                category[-36:], timing.calls if counts is None else counts.get(category, 0),
+                timing.total, timing.own
+                ))
+        return lines
+
+    def get_report(self):
+        wall = (default_timer() if self.t_stop is None else self.t_stop) - self.t_start
+        instrumented = sum( timing.own for timing in self.stages.values() + self.blocks.values() )
+        lines = [ 'texhelp profile: {0:.4f} s wall time'.format(wall) ]
+        lines.extend(self.format_table('Stages', self.stages))
+        lines.append('    {0:<36} {1:>9} {2:>10} {3:>10.4f}'.format(
+            'not instrumented (I/O, output, ...)', '', '', max(wall - instrumented, 0.)
+            ))
+        if self.blocks:
+            lines.extend(self.format_table('Blocks', self.blocks, self.block_counts))
+        if self.files:
+            lines.extend(self.format_table('Files', self.files))
+        if self.dump:
+            lines.append('cProfile stats written to {0}'.format(self.dump))
+        return '\n'.join(lines)
+
+    def print_report(self):
+        self.stream.write(self.get_report() + '\n')
+
+
+def add_profile_arguments(parser):
+    """Adds the profiling options shared by the texhelp scripts to an ArgumentParser"""
+    parser.add_argument(
+        '--profile', action='store_true', default=False,
+        help='print per-stage, per-block and per-file timings to stderr (not of --jobs workers)'
+        )
+    parser.add_argument(
+        '--profile-dump', type=str, metavar='FILE',
+        help='also write cProfile stats to FILE, for use with pstats'
+        )
+
+
+def start_from_args(args):
+    """
+    Starts a Profiler if --profile or --profile-dump was passed, and prints its
+    report when the script exits. Returns the Profiler, or None.
+    """
+    if not(args.profile or args.profile_dump): return None
+    profiler = Profiler(dump=args.profile_dump).start()
+    atexit.register(profiler.stop)
+    return profiler
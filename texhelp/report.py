@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+from collections import Counter
+
+from tex_scanner import SECTION_NAMES, INCLUDE_DIRECTIVES, REF_DIRECTIVES
+from bib_tex_matcher import split_cite_keys
+from xref import split_ref_keys
+
+#____________________________________________________________________
+# All analyses of a tex project from one walk, as JSON Lines records
+
+REPORT_NAMES = (
+    SECTION_NAMES + INCLUDE_DIRECTIVES + REF_DIRECTIVES + [ 'cite', 'label', 'caption', 'includegraphics', 'figure' ]
+    )
+
+
+def is_within(node, i_begin, figure):
+    """Whether a record at i_begin in node lies inside figure, possibly through includes"""
+    figure_node, i_end = figure[0], figure[1]
+    while not(node is figure_node):
+        if node.parent is None: return False
+        node, i_begin = node.parent, node.record[1]
+    return i_begin < i_end
+
+
+def gen_report_records(project):
+    """
+    Yields one dict per document, input, section, cite key, label, ref,
+    figure, caption and image of a TexProject, in document order, followed
+    by a summary with the counts per type. Records inside a figure carry
+    the number of the figure.
+    """
+    root_dir = project.root_dir
+    relpaths = {}
+    def relpath(path):
+        if not path in relpaths: relpaths[path] = os.path.relpath(path, root_dir)
+        return relpaths[path]
+
+    counts = Counter()
+    def emit(record_type, node, i_begin, **fields):
+        counts[record_type] += 1
+        fields['type'] = record_type
+        fields['file'] = relpath(node.path)
+        fields['offset'] = i_begin
+        return fields
+
+    yield { 'type' : 'document', 'file' : os.path.basename(project.main_file), 'root_dir' : root_dir }
+
+    # (node, i_begin of the include record) -> path of includes that do not exist
+    missing = dict( ((id(node), record[1]), path) for node, record, path in project.missing )
+    # (node, i_end, number) of the figure that records are currently in
+    figure = None
+    i_figure = 0
+
+    for node, record in project.gen_records(*REPORT_NAMES):
+        name, i_begin, i_end, arg = record
+        if not(figure is None) and not is_within(node, i_begin, figure):
+            figure = None
+        in_figure = {} if figure is None else { 'figure' : figure[2] }
+
+        if name in INCLUDE_DIRECTIVES:
+            child = node.children.get(i_begin)
+            if child is None and not (id(node), i_begin) in missing: continue
+            yield emit(
+                'input', node, i_begin, directive=name,
+                path=relpath(missing[(id(node), i_begin)] if child is None else child.path),
+                depth=node.depth() + 1, exists=not(child is None)
+                )
+        elif name in SECTION_NAMES:
+            yield emit('section', node, i_begin, level=SECTION_NAMES.index(name), name=name, title=arg)
+        elif name == 'cite':
+            for key in split_cite_keys(arg):
+                yield emit('cite', node, i_begin, key=key, **in_figure)
+        elif name in REF_DIRECTIVES:
+            for key in split_ref_keys(name, arg):
+                yield emit('ref', node, i_begin, directive=name, label=key, **in_figure)
+        elif name == 'label':
+            yield emit('label', node, i_begin, label=arg, **in_figure)
+        elif name == 'caption':
+            yield emit('caption', node, i_begin, caption=arg, **in_figure)
+        elif name == 'includegraphics':
+            yield emit('image', node, i_begin, image=arg, **in_figure)
+        elif name == 'figure':
+            i_figure += 1
+            figure = (node, i_end, i_figure)
+            yield emit('figure', node, i_begin, figure=i_figure, end=i_end)
+
+    summary = dict(counts)
+    summary['type'] = 'summary'
+    summary['files'] = sum( 1 for node in project.gen_nodes() )
+    yield summary
+
+
+def write_report(project, stream):
+    """Writes the records of gen_report_records to stream, one JSON object per line"""
+    for record in gen_report_records(project):
+        stream.write(json.dumps(record, sort_keys=True))
+        stream.write('\n')
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+import texhelp
+import os
+import time
+import shutil
+import tempfile
+
+
+class TestBibIndex(TestCase):
+
+    entries = [
+        '@article{a,\n    title = "A { } b",\n    year = "2014"\n    }',
+        '@Comment{not, an entry}',
+        '@book{b:2015,\n    title = {B}\n    }',
+        ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bibfile = os.path.join(self.tmpdir, 'refs.bib')
+        self.write(self.entries)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, entries):
+        with open(self.bibfile, 'w') as fp:
+            fp.write('\n\n'.join(entries))
+
+    def test_lookup(self):
+        with texhelp.BibIndex(self.bibfile) as index:
+            self.assertEqual(sorted(index.get_citenames()), ['a', 'b:2015'])
+            self.assertEqual(index.get_raw('b:2015'), self.entries[2])
+            self.assertRaises(KeyError, index.get_raw, 'c')
+            citations = index.get_citations(['a', 'c'], texhelp.BibFormatter(cms_style=False))
+            self.assertEqual(citations.keys(), ['a'])
+            self.assertEqual(citations['a'].fields['year'], '2014')
+
+    def test_rebuild(self):
+        texhelp.BibIndex(self.bibfile).close()
+        self.assertTrue(os.path.isfile(texhelp.bib_index.default_bib_index_path(self.bibfile)))
+        index = texhelp.BibIndex(self.bibfile)
+        self.assertEqual(index.n_builds, 0)
+        # Make sure the mtime changes
+        time.sleep(0.01)
+        self.write(self.entries + [ '@misc{c, year = "1"}' ])
+        self.assertEqual(index.get_raw('c'), '@misc{c, year = "1"}')
+        self.assertEqual(index.n_builds, 1)
+        index.close()
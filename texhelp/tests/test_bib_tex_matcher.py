@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+import texhelp
+import os
+import shutil
+import tempfile
+
+
+class TestBibTexMatcher(TestCase):
+
+    tex = (
+        'Text \\cite{a, b} and \\cite{c % a comment, d\n'
+        '    ,a}\n'
+        '% \\cite{commented}\n'
+        )
+    bib = '\n\n'.join([
+        '@article{a,\n    title = "A",\n    year = "2014"\n    }',
+        '@Comment{not, an entry}',
+        '@book{b,\n    title = {B}\n    }',
+        '@book{unused,\n    title = {U}\n    }',
+        '@article{a,\n    title = "A again"\n    }',
+        ])
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.texfile = os.path.join(self.tmpdir, 'main.tex')
+        self.bibfile = os.path.join(self.tmpdir, 'refs.bib')
+        with open(self.texfile, 'w') as fp:
+            fp.write(self.tex)
+        with open(self.bibfile, 'w') as fp:
+            fp.write(self.bib)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, matcher):
+        self.assertEqual(matcher.cites.keys(), ['a', 'b', 'c'])
+        self.assertEqual(matcher.n_cite_commands, 2)
+        self.assertEqual(len(matcher.cites['a']), 2)
+        self.assertEqual(matcher.missing, ['c'])
+        self.assertEqual(matcher.unused, ['unused'])
+        self.assertEqual(matcher.duplicates, ['a'])
+        # The first entry wins
+        self.assertEqual(matcher.get_citation('a').fields['year'], '2014')
+
+    def test_split_cite_keys(self):
+        from texhelp.bib_tex_matcher import split_cite_keys
+        self.assertEqual(split_cite_keys(' a,b , c,'), ['a', 'b', 'c'])
+        self.assertEqual(split_cite_keys('a % b\n, c'), ['a', 'c'])
+
+    def test_scanned(self):
+        project = texhelp.open_project(self.texfile)
+        bib_tree = texhelp.BibScanner().interpret_file(self.bibfile)
+        self.check(texhelp.BibTexMatcher([ project ], [ bib_tree ]).process())
+
+    def test_indexed(self):
+        project = texhelp.open_project(self.texfile)
+        with texhelp.BibIndex(self.bibfile, path=None) as index:
+            matcher = texhelp.BibTexMatcher([ project ], [ index ], bib_names=[ 'refs.bib' ]).process()
+            self.check(matcher)
+            self.assertEqual(matcher.bib_entries['a'][1][0], 'refs.bib')
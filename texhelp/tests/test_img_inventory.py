@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+import texhelp
+import os
+import shutil
+import tempfile
+
+
+class TestImageInventory(TestCase):
+
+    tex = (
+        '\\includegraphics[width=0.5\\textwidth]{img/a}\n'
+        '\\includegraphics{img/sub/b.png}\n'
+        '\\includegraphics{img/missing}\n'
+        '\\import{chapter/}{part}\n'
+        )
+    part = '\\includegraphics{c}\n'
+    images = [ 'img/a.png', 'img/a.pdf', 'img/sub/b.png', 'img/unused.eps', 'img/notes.txt', 'chapter/c.jpg' ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.texfile = os.path.join(self.tmpdir, 'main.tex')
+        self.write('main.tex', self.tex)
+        self.write('chapter/part.tex', self.part)
+        for image in self.images:
+            self.write(image, '')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, relpath, text):
+        path = os.path.join(self.tmpdir, relpath)
+        if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(text)
+
+    def relpaths(self, paths):
+        return [ os.path.relpath(path, self.tmpdir) for path in paths ]
+
+    def test_lookup(self):
+        inventory = texhelp.ImageInventory(os.path.join(self.tmpdir, 'img'))
+        self.assertEqual(len(inventory), 4)
+        # .pdf is preferred over .png, as by pdflatex
+        self.assertEqual(self.relpaths([ inventory.lookup(os.path.join(self.tmpdir, 'img/a')) ]), [ 'img/a.pdf' ])
+        self.assertEqual(inventory.lookup(os.path.join(self.tmpdir, 'img/./sub/../a.png')), os.path.join(self.tmpdir, 'img/a.png'))
+        self.assertEqual(inventory.lookup(os.path.join(self.tmpdir, 'img/notes')), None)
+
+    def test_reconcile(self):
+        reconciler = texhelp.Helper(self.texfile).reconcile_images(os.path.join(self.tmpdir, 'img'))
+        self.assertEqual(
+            [ (arg, os.path.relpath(path, self.tmpdir)) for arg, path in reconciler.found ],
+            [ ('img/a', 'img/a.pdf'), ('img/sub/b.png', 'img/sub/b.png'), ('c', 'chapter/c.jpg') ]
+            )
+        self.assertEqual(reconciler.missing, [ 'img/missing' ])
+        self.assertEqual(self.relpaths(reconciler.unused), [ 'img/a.png', 'img/unused.eps' ])
+
+    def test_archive(self):
+        paths = [ os.path.join(self.tmpdir, image) for image in [ 'img/a.png', 'img/sub/b.png', 'img/unused.eps' ] ]
+        archive_dir = os.path.join(self.tmpdir, 'archive')
+        moves = texhelp.archive_images(paths, self.tmpdir, archive_dir, batch_size=2)
+        self.assertEqual(len(moves), 3)
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.isfile(os.path.join(archive_dir, 'img/sub/b.png')))
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from unittest import TestCase
+from StringIO import StringIO
 
 import texhelp
+import os
+import tempfile
+import threading
+import cPickle as pickle
 import logging
 
 
@@ -35,6 +40,268 @@ class TestTexInterpreter(TestCase):
         tree = self.interpreter.interpret('aaaa\cite{bb%cc\nbb}')
         self.assertEqual(tree.parse(), 'aaaa\cite{bbbb}')
 
+    def test_import_block(self):
+        text = 'a\\import{chapters/}{intro}b{c}'
+        block = texhelp.tex_interpreter.ImportBlock(1, text)
+        self.assertEqual(block.matches, [ '{chapters/}', '{intro}' ])
+        self.assertEqual(block.relpath_file, 'chapters/intro')
+        self.assertEqual(block.process(), '{{chapters/}{intro}')
+        self.assertEqual(block.advance_index_at_open(), len('\\import{chapters/}{intro'))
+        with self.assertRaises(ValueError):
+            texhelp.tex_interpreter.ImportBlock(1, 'a\\import{chapters/}b')
+
+    def test_includegraphics_block(self):
+        IncludeGraphicsBlock = texhelp.tex_interpreter.IncludeGraphicsBlock
+        for text, square_brackets, r in [
+                ('a\\includegraphics{fig.pdf}b', '', len('\\includegraphics')),
+                ('a\\includegraphics[width=0.5\\textwidth]{fig.pdf}b[c]', '[width=0.5\\textwidth]',
+                    len('\\includegraphics[width=0.5\\textwidth]{')),
+                ]:
+            block = IncludeGraphicsBlock(1, text)
+            self.assertEqual(block.advance_index_at_open(), r)
+            self.assertEqual(block.square_brackets, square_brackets)
+            self.assertEqual(
+                block.process('fig.pdf'), '\\includegraphics' + square_brackets + '{fig.pdf}'
+                )
+
+    def test_dispatcher(self):
+        text = '{a}\\cite{b}\\\\section{c}\\subsection{d}\\begin{figure}\\includegraphics[w]{e}\\%f\\import{g}{h}'
+        for i in range(len(text)):
+            self.assertEqual(
+                [ block.name for block in self.interpreter.blocks if block.open(text, i) ],
+                [ block.name for block in self.interpreter.blocks
+                    if text[i-1] != '\\' and text[i:].startswith(block.open_tag) ]
+                )
+
+    def test_dispatcher_threads(self):
+        BracketBlock = texhelp.tex_interpreter.BracketBlock
+        texts = [ 'a{b}' * 500, '\\cite{x}' * 500 ]
+        expected = [ [ i for i in range(len(text)) if BracketBlock.open(text, i) ] for text in texts ]
+        results = {}
+        def find(i_text):
+            text = texts[i_text]
+            results[i_text] = [ i for i in range(len(text)) if BracketBlock.open(text, i) ]
+        threads = [ threading.Thread(target=find, args=(i_text,)) for i_text in [ 0, 1 ] * 4 ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual([ results[0], results[1] ], expected)
+
+    def test_dispatch_once(self):
+        tmpdir = self.write_files({
+            'main.tex' : 'a\\input{x}b{c}\\input{y}d\\input{x}',
+            'x.tex' : '{x}\\cite{c}',
+            'y.tex' : '\\input{x}{y}',
+            })
+        dispatcher = texhelp.tex_interpreter.dispatcher
+        scanned = []
+        scan = dispatcher.scan
+        def counting_scan(text):
+            scanned.append(text)
+            return scan(text)
+        dispatcher.scan = counting_scan
+        try:
+            self.interpreter.interpret_file(os.path.join(tmpdir, 'main.tex'))
+        finally:
+            del dispatcher.scan
+        # Every text is walked once, though includes interrupt the parse of main
+        self.assertEqual(
+            sorted(scanned), [ '\\input{x}{y}', 'a\\input{x}b{c}\\input{y}d\\input{x}', '{x}\\cite{c}' ]
+            )
+
+    def write_files(self, files):
+        tmpdir = tempfile.mkdtemp()
+        for name, text in files.items():
+            path = os.path.join(tmpdir, name)
+            if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(text)
+        return tmpdir
+
+    def test_shared_input(self):
+        tmpdir = self.write_files({
+            'main.tex' : 'a\\input{shared}b\\input{shared}',
+            'shared.tex' : 'c\\label{x}',
+            })
+        self.interpreter.set_base_file(os.path.join(tmpdir, 'main.tex'))
+        tree = self.interpreter.interpret_file(os.path.join(tmpdir, 'main.tex'))
+        self.assertEqual(list(self.interpreter.subtree_cache), [os.path.join(tmpdir, 'shared.tex')])
+        # The shared subtree is found at both include sites
+        self.assertEqual(
+            [ node.block.get_text_no_tags() for node in tree.gen_blocks_by_name('label') ], ['x', 'x']
+            )
+        self.assertEqual(tree.parse(), 'ac\\label{x}bc\\label{x}')
+
+    def test_include_cycle(self):
+        tmpdir = self.write_files({
+            'a.tex' : '\\input{b}',
+            'b.tex' : '\\input{a}',
+            })
+        self.interpreter.set_base_file(os.path.join(tmpdir, 'a.tex'))
+        with self.assertRaises(ValueError):
+            self.interpreter.interpret_file(os.path.join(tmpdir, 'a.tex'))
+
+    subimport_files = {
+        'main.tex' : 'a\\import{chapters/}{intro}b\\input{shared}',
+        'chapters/intro.tex' : 'c\\subimport{sec/}{a}d\\input{shared}',
+        'chapters/sec/a.tex' : 'e\\subimport{fig/}{b}',
+        'chapters/sec/fig/b.tex' : 'f',
+        'shared.tex' : 'g',
+        }
+
+    def test_subimport_context(self):
+        tmpdir = self.write_files(self.subimport_files)
+        self.interpreter.set_base_file(os.path.join(tmpdir, 'main.tex'))
+        self.interpreter.interpret_file(os.path.join(tmpdir, 'main.tex'))
+        # Files with a \\subimport or \\input are kept per import directory
+        path = lambda name: os.path.join(tmpdir, name)
+        self.assertEqual(
+            set(self.interpreter.subtree_cache),
+            set([
+                (path('chapters/intro.tex'), 'chapters'), (path('chapters/sec/a.tex'), 'chapters/sec'),
+                path('chapters/sec/fig/b.tex'), path('shared.tex')
+                ])
+            )
+
+    def test_import_dir_cache(self):
+        tmpdir = self.write_files({
+            'main.tex' : '\\import{a/}{../common/part}\\import{b/}{../common/part}',
+            'common/part.tex' : '\\subimport{}{fig}',
+            'a/fig.tex' : '\\label{fa}',
+            'b/fig.tex' : '\\label{fb}',
+            })
+        main = os.path.join(tmpdir, 'main.tex')
+        self.interpreter.set_base_file(main)
+        tree = self.interpreter.interpret_file(main)
+        # The same file pulls in a different figure in each import directory
+        self.assertEqual([ node.block.get_text_no_tags() for node in tree.gen_blocks_by_name('label') ], ['fa', 'fb'])
+        part = os.path.join(tmpdir, 'common/part.tex')
+        self.assertTrue((part, 'a') in self.interpreter.subtree_cache)
+        self.assertTrue((part, 'b') in self.interpreter.subtree_cache)
+
+        self.get_context(main)
+        self.assertEqual(
+            self.interpreter.find_independent_subtrees(main),
+            [ os.path.join(tmpdir, 'a/fig.tex'), os.path.join(tmpdir, 'b/fig.tex') ]
+            )
+
+    def test_xref_locations(self):
+        tmpdir = self.write_files({
+            'main.tex' : '\\label{a}\\import{chapters/}{intro}\\ref{b}',
+            'chapters/intro.tex' : 'x\\label{b}\\input{shared}',
+            'shared.tex' : '\\cref{a, c}',
+            })
+        main = os.path.join(tmpdir, 'main.tex')
+        self.interpreter.set_base_file(main)
+        xref = texhelp.XRefIndex.from_tree(self.interpreter.interpret_file(main), main)
+        self.assertEqual(xref.labels['a'], [ (main, 0) ])
+        # Offsets are relative to the file the block is in
+        self.assertEqual(xref.labels['b'], [ (os.path.join(tmpdir, 'chapters/intro.tex'), 1) ])
+        self.assertEqual(xref.refs['c'], [ ('cref', (os.path.join(tmpdir, 'shared.tex'), 0)) ])
+
+    def test_same_tree_as_project(self):
+        tmpdir = self.write_files({
+            'main.tex' : '\\import{chapters/}{intro}\\input{shared}',
+            # sec is found in the import directory, shared in the main directory
+            'chapters/intro.tex' : '\\input{sec}\\input{shared}',
+            'chapters/sec.tex' : 'a',
+            'sec.tex' : 'b',
+            'shared.tex' : 'c',
+            })
+        main = os.path.join(tmpdir, 'main.tex')
+        self.interpreter.set_base_file(main)
+        self.interpreter.interpret_file(main)
+        self.assertEqual(
+            sorted( key if isinstance(key, str) else key[0] for key in self.interpreter.subtree_cache ),
+            sorted(texhelp.TexProject(main).get_paths() - set([ main ]))
+            )
+        self.assertTrue(os.path.join(tmpdir, 'chapters/sec.tex') in self.interpreter.subtree_cache)
+
+    def get_context(self, main):
+        self.interpreter.context = texhelp.tex_interpreter.ParseContext(main)
+
+    def test_independent_subtrees(self):
+        tmpdir = self.write_files(self.subimport_files)
+        self.get_context(os.path.join(tmpdir, 'main.tex'))
+        self.assertEqual(
+            self.interpreter.find_independent_subtrees(os.path.join(tmpdir, 'main.tex')),
+            [ os.path.join(tmpdir, 'chapters/sec/fig/b.tex'), os.path.join(tmpdir, 'shared.tex') ]
+            )
+
+    def test_independent_chapters(self):
+        tmpdir = self.write_files({
+            'main.tex' : '\\input{ch1}\\input{ch2}\\include{skipped}\\input{cycle1}',
+            'ch1.tex' : '\\input{s1}\\input{s2}',
+            'ch2.tex' : '\\import{sec/}{s3}',
+            'sec/s3.tex' : '\\subimport{x/}{y}',
+            'sec/x/y.tex' : 'y',
+            's1.tex' : 's1',
+            's2.tex' : 's2',
+            'skipped.tex' : '\\input{s1}',
+            'cycle1.tex' : '\\input{cycle2}',
+            'cycle2.tex' : '\\input{cycle1}',
+            })
+        self.get_context(os.path.join(tmpdir, 'main.tex'))
+        self.assertEqual(
+            self.interpreter.find_independent_subtrees(os.path.join(tmpdir, 'main.tex')),
+            [ os.path.join(tmpdir, 'ch1.tex'), os.path.join(tmpdir, 'ch2.tex') ]
+            )
+
+    def test_parallel(self):
+        files = {}
+        for i in range(4):
+            files['ch{0}.tex'.format(i)] = '\\section{{c{0}}}\\input{{sec{0}}}'.format(i)
+            files['sec{0}.tex'.format(i)] = '\\subsection{{s{0}}}x\\cite{{c{0}}}'.format(i)
+        files['main.tex'] = ''.join( 'a\\input{{ch{0}}}'.format(i) for i in range(4) )
+        tmpdir = self.write_files(files)
+        main = os.path.join(tmpdir, 'main.tex')
+
+        # Without set_base_file, includes resolve relative to main.tex
+        serial = self.interpreter.interpret_file(main).parse()
+        interpreter = texhelp.TexInterpreter()
+        interpreter.jobs = 2
+        self.assertEqual(interpreter.interpret_file(main).parse(), serial)
+        self.assertEqual(len(interpreter.subtree_cache), 8)
+
+    def test_threads(self):
+        projects = []
+        for i in range(4):
+            # A chain of includes main -> sec0 -> ... -> sec19
+            files = dict( ('sec{0}.tex'.format(j), '\\label{{p{0}s{1}}}\\input{{sec{2}}}'.format(i, j, j+1)) for j in range(19) )
+            files['sec19.tex'] = '\\label{{p{0}s19}}'.format(i)
+            files['main.tex'] = '\\input{sec0}'
+            projects.append(os.path.join(self.write_files(files), 'main.tex'))
+        serial = [ texhelp.TexInterpreter().interpret_file(main).parse() for main in projects ]
+
+        # Parses in different threads keep their own include stack and cache
+        results = {}
+        def parse(main):
+            results[main] = texhelp.TexInterpreter().interpret_file(main).parse()
+        threads = [ threading.Thread(target=parse, args=(main,)) for main in projects ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual([ results.get(main) for main in projects ], serial)
+
+    def test_prefetch(self):
+        tmpdir = self.write_files(self.subimport_files)
+        main = os.path.join(tmpdir, 'main.tex')
+        self.interpreter.set_base_file(main)
+        serial = self.interpreter.interpret_file(main).parse()
+
+        reads = []
+        def read(path):
+            reads.append(os.path.relpath(path, tmpdir))
+            return open(path).read()
+        interpreter = texhelp.TexInterpreter()
+        interpreter.set_base_file(main)
+        interpreter.prefetch = 4
+        interpreter.read_file = read
+        self.assertEqual(interpreter.interpret_file(main).parse(), serial)
+        # Included files are parsed from the text the prefetcher read
+        self.assertEqual(
+            sorted(reads),
+            [ 'chapters/intro.tex', 'chapters/sec/a.tex', 'chapters/sec/fig/b.tex', 'main.tex', 'shared.tex' ]
+            )
+
 
 class TestBibInterpreter(TestCase):
 
@@ -54,6 +321,55 @@ class TestBibInterpreter(TestCase):
         self.assertEqual(entry.block.entry_type, 'article')
         self.assertEqual(entry.block.get_text_no_tags(), 'field="bla"')
 
+    def test_entry_block(self):
+        text = 'aaa@InProceedings{x,\n    year = "2014"}'
+        block = texhelp.bib_interpreter.EntryBlock(3, text)
+        self.assertEqual(block.open_tag, '@InProceedings{')
+        self.assertEqual(block.entry_type, 'inproceedings')
+
+
+class TestBibScanner(TestBibInterpreter):
+
+    def setUp(self):
+        self.interpreter = texhelp.BibScanner()
+
+    def test_quoted_brace(self):
+        text = '@article{a,\n title = "a } b"\n}\n@book{b, title="c"}'
+        entries = list(self.interpreter.interpret(text).gen_blocks_by_name('entry'))
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0].block.get_text(), '@article{a,\n title = "a } b"\n}')
+        self.assertEqual(entries[1].block.entry_type, 'book')
+
+    def test_braced_value(self):
+        text = '@article{a, title = {A {B} c}, year = "2014"} @misc{b, year = "1"}'
+        entries = list(self.interpreter.interpret(text).gen_blocks_by_name('entry'))
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(
+            entries[0].block.get_text_no_tags(), 'a, title = {A {B} c}, year = "2014"'
+            )
+
+    def test_escapes(self):
+        text = '\\@nope{x} @article{a, title = "a \\" } b"}'
+        entries = list(self.interpreter.interpret(text).gen_blocks_by_name('entry'))
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].block.get_text(), '@article{a, title = "a \\" } b"}')
+
+    def test_unterminated(self):
+        with self.assertRaises(ValueError):
+            self.interpreter.interpret('@article{a, title = "b"')
+
+    def test_streaming(self):
+        text = (
+            'junk "@misc{no}" @article{a,\n title = "a } b"\n}\n'
+            '@book{b, title = {c {d}}, note="\\""} @misc{c, year="2014"}'
+            )
+        tree = self.interpreter.interpret(text)
+        expected = [ node.block.get_text() for node in tree.gen_blocks_by_name('entry') ]
+        self.assertEqual(len(expected), 3)
+        for chunk_size in [1, 2, 3, 7, 1000]:
+            entries = list(texhelp.iter_bib_entries(StringIO(text), chunk_size))
+            self.assertEqual(entries, expected)
+
 
 class TestBibFormatter(TestCase):
     
@@ -105,6 +421,171 @@ class TestBibFormatter(TestCase):
         logging.debug('Processed:\n{0}'.format(citation.parse()))
         self.assertEqual(citation.parse(), text)
 
+    def test_split_fields(self):
+        split_fields = texhelp.bib_formatter.split_fields
+        self.assertEqual(
+            split_fields('a = "b, \\"c",\n d = "e,\n f",\n'),
+            ['a = "b, \\"c"', ' d = "e, f"']
+            )
+        self.assertEqual(
+            split_fields('x, a = {b, "c}, d = "e"', 2),
+            [' a = {b, "c}', ' d = "e"']
+            )
+
+    def test_offsets(self):
+        text = 'junk @article{a,\n    year = "2014",\n    Title = "x"\n    }\n junk'
+        citation = texhelp.bib_formatter.BibCitation(text, 5, len(text) - 6)
+        citation.get_entry_type()
+        citation.read_fields()
+        self.assertEqual(citation.raw, text[5:-6])
+        self.assertEqual(citation.keys, ['year', 'title'])
+        self.assertTrue(citation.keys[1] is intern('title'))
+        citation.remove_key('year')
+        copy = pickle.loads(pickle.dumps(citation, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.source, text[5:-6])
+        self.assertEqual(copy.parse(), citation.parse())
+
+    def test_repeated_key(self):
+        citation = texhelp.BibFormatter(cms_style=False).get_citation(
+            '@article{a,\n    year = "2013",\n    title = "x",\n    year = "2014"\n    }'
+            )
+        # Written as often as it occurs, with the last value
+        self.assertEqual(citation.keys, ['year', 'title', 'year'])
+        self.assertEqual(citation.parse().count('year  = "2014"'), 2)
+
+    def test_spans(self):
+        text = '@article{a,\n    year = "2014"\n    }\n@article{b,\n    year = "2015"\n    }\n'
+        spans = list(texhelp.iter_bib_entries(StringIO(text), spans=True))
+        self.assertEqual([ (i_begin, i_end) for buf, i_begin, i_end in spans ], [ (0, 35), (36, 71) ])
+        citations = list(texhelp.BibFormatter(cms_style=False).iter_citations(spans))
+        # The citations point into the buffer the entries were read into
+        self.assertTrue(citations[1].source is spans[1][0])
+        self.assertEqual(citations[1].raw, text[36:71])
+
+    def test_cache(self):
+        raws = [
+            '@article{a,\n    title = "Some Title",\n    year = "2014"\n    }',
+            '@article{b,\n    title = "{SU(3)} symmetry"\n    }',
+            ]
+        expected = [ self.formatter.get_citation(raw).parse() for raw in raws ]
+        cache_file = os.path.join(tempfile.mkdtemp(), 'cache.pkl')
+        for i_run in range(2):
+            self.formatter.cache = texhelp.CitationCache(cache_file, max_entries=1)
+            citations = self.formatter.get_citations(raws)
+            self.assertEqual([ c.parse() for c in citations ], expected)
+            self.assertEqual(self.formatter.cache.hits, i_run)
+            self.formatter.cache.save()
+        self.assertEqual(citations[1].err_msgs, ['year field not given'])
+
+    def test_jobs(self):
+        raws = [
+            '@article{a{0},\n    title = "Some Title",\n    pages = "1-{0}",\n    year = "2014"\n    }',
+            '@article{b{0},\n    title = "{SU(3)} symmetry",\n}',
+            '@article{c{0},\n    title = "x",\n    url = "http://x",\n    doi = "10.1/{0}"\n    }',
+            ]
+        raws = [ raw.replace('{0}', str(i)) for i in range(5) for raw in raws ]
+        collector = texhelp.bib_formatter._RecordCollector()
+        root = logging.getLogger()
+        level = root.level
+        root.addHandler(collector)
+        root.setLevel(logging.WARNING)
+        results = []
+        try:
+            for jobs in [ 1, 2 ]:
+                del collector.records[:]
+                citations = list(self.formatter.iter_citations(raws, jobs=jobs, batch_size=4))
+                results.append((
+                    [ (c.citename, c.parse(), c.err_msgs, c.warning_msgs) for c in citations ],
+                    list(collector.records)
+                    ))
+        finally:
+            root.removeHandler(collector)
+            root.setLevel(level)
+        self.assertEqual([ r[0] for r in results[0][0] ], [ name + str(i) for i in range(5) for name in 'abc' ])
+        self.assertEqual(results[0][0][1][2], ['year field not given'])
+        self.assertTrue(results[0][0][0][3])
+        self.assertEqual(results[1], results[0])
+
+    def test_cache_fingerprint(self):
+        raws = [ '@article{a,\n    title = "Some Title",\n    journal = "Physics Letters"\n    }' ]
+        cache_file = os.path.join(tempfile.mkdtemp(), 'cache.pkl')
+        self.formatter.cache = texhelp.CitationCache(cache_file)
+        self.formatter.get_citations(raws)
+        self.formatter.cache.save()
+
+        @texhelp.bib_formatter.CMSCiteFormatter.rules.register('test_journal', fields=['journal'])
+        def abbreviate_journal(formatter):
+            formatter.fields['journal'] = 'Phys. Lett.'
+            return True
+        try:
+            self.formatter.cache = texhelp.CitationCache(cache_file)
+            citation = self.formatter.get_citations(raws)[0]
+        finally:
+            texhelp.bib_formatter.CMSCiteFormatter.rules.remove('test_journal')
+        self.assertEqual(self.formatter.cache.hits, 0)
+        self.assertIn('Phys. Lett.', citation.parse())
+
+        # Rules that only differ in a constant
+        fingerprints = []
+        for journal in [ 'Phys. Lett.', 'Phys. Lett. B' ]:
+            namespace = {}
+            exec 'def abbreviate_journal(formatter):\n    formatter.fields["journal"] = {0!r}\n'.format(journal) in namespace
+            texhelp.bib_formatter.CMSCiteFormatter.rules.register('test_journal', fields=['journal'])(namespace['abbreviate_journal'])
+            try:
+                fingerprints.append(self.formatter.get_fingerprint())
+            finally:
+                texhelp.bib_formatter.CMSCiteFormatter.rules.remove('test_journal')
+        self.assertNotEqual(fingerprints[0], fingerprints[1])
+
+        reinterpreter = texhelp.bib_formatter.CMSCiteFormatter.title_reinterpreter
+        fingerprint = self.formatter.get_fingerprint()
+        reinterpreter.protected_words['title'] = 'Title'
+        try:
+            self.assertNotEqual(self.formatter.get_fingerprint(), fingerprint)
+        finally:
+            del reinterpreter.protected_words['title']
+        self.assertEqual(self.formatter.get_fingerprint(), fingerprint)
+
+
+class TestBibRules(TestCase):
+
+    def setUp(self):
+        self.rules = texhelp.bib_rules.RuleSet()
+        self.calls = []
+        for name, fields, adds in [ ('a', None, ()), ('b', ['x'], ['y']), ('c', ['y'], ()), ('d', ['z'], ()) ]:
+            self.rules.register(name, fields, adds)(self.make_check(name))
+
+    def make_check(self, name):
+        def check(formatter):
+            self.calls.append(name)
+            if name == 'b': formatter.fields['y'] = '1'
+            return name == 'a'
+        return check
+
+    def test_indexed(self):
+        formatter = texhelp.bib_formatter.CMSCiteFormatter('@article{', { 'x' : '1' })
+        self.rules.apply(formatter)
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+        self.assertEqual(
+            [ (rule.stats.runs, rule.stats.hits) for rule in self.rules.rules ],
+            [ (1, 1), (1, 0), (1, 0), (0, 0) ]
+            )
+
+    def test_site_rule(self):
+        @texhelp.bib_formatter.CMSCiteFormatter.rules.register('test_journal', fields=['journal'])
+        def abbreviate_journal(formatter):
+            formatter.fields['journal'] = formatter.fields['journal'].replace('Physics Letters', 'Phys. Lett.')
+            return True
+        try:
+            formatter = texhelp.bib_formatter.CMSCiteFormatter(
+                '@article{', { 'journal' : 'Physics Letters', 'volume' : 'B738', 'href' : 'x' }
+                )
+            formatter.check_fields()
+        finally:
+            texhelp.bib_formatter.CMSCiteFormatter.rules.remove('test_journal')
+        self.assertEqual(formatter.fields['journal'], 'Phys. Lett. B')
+        self.assertEqual(formatter.err_msgs[1][:18], 'Found key \'href\' (')
+
 
 class TestBibTitleFormatter(TestCase):
 
@@ -139,6 +620,71 @@ class TestBibTitleFormatter(TestCase):
             )
 
 
+class TestTitleReinterpreter(TestCase):
 
+    def setUp(self):
+        self.reinterpreter = texhelp.bib_formatter.TitleReinterpreter(max_cached_words=4)
 
+    def test_batch(self):
+        titles = [
+            'Two Words', 'Two Words $u_{some_math}$', 'SU(3) $math$ GeV',
+            'at {$\\sqrt{s}$} = 8 {TeV} with', 'too much      space',
+            '$onlymath$', '$only$ $math$', '$only$ $math$ with text', 'Two Words',
+            ]
+        self.assertEqual(
+            self.reinterpreter.reinterpret_titles(titles),
+            [
+                'Two words', 'Two words {$u_{some_math}$}', '{SU(3)} {$math$} {GeV}',
+                'at {$\\sqrt{s}$} = 8 {TeV} with', 'too much space',
+                '{$onlymath$}', '{$only$} {$math$}', '{$only$} {$math$} with text', 'Two words',
+                ]
+            )
+        self.assertTrue(len(self.reinterpreter.word_cache) <= 4)
+
+    def test_protected_words(self):
+        self.assertEqual(
+            self.reinterpreter.reinterpret('Search for the Higgs Boson'), 'Search for the {H}iggs boson'
+            )
+        self.reinterpreter = texhelp.bib_formatter.TitleReinterpreter({ 'boson' : '{B}oson' })
+        self.assertEqual(
+            self.reinterpreter.reinterpret('Search for the Higgs Boson'), 'Search for the higgs {B}oson'
+            )
+
+
+class TestBibDeduplicator(TestCase):
+
+    raws = [
+        '@article{a,\n    title = "Observation of a new boson at a mass of 125 GeV",\n    doi = "10.1016/j.physletb.2012.08.021"\n    }',
+        '@article{b,\n    title = "Something else entirely",\n    eprint = "arXiv:1207.7235v2"\n    }',
+        '@article{c,\n    title = "Observation of a New Boson at a Mass of 125 {GeV}",\n    doi = "https://doi.org/10.1016/J.PHYSLETB.2012.08.021"\n    }',
+        '@article{d,\n    title = "Observation of a new boson at a mass of 125 GeV with the CMS experiment",\n    eprint = "1207.7235"\n    }',
+        '@article{e,\n    title = "Observation of a new boson at a mass of 125 GeV",\n    doi = "10.1000/other"\n    }',
+        '@article{f,\n    title = "Something else, entirely"\n    }',
+        ]
+
+    def test_clusters(self):
+        formatter = texhelp.BibFormatter(cms_style=False)
+        citations = [ formatter.get_citation(raw) for raw in self.raws ]
+        deduplicator = texhelp.BibDeduplicator().add_citations(citations).process()
+        # e has the title of a but another doi
+        self.assertEqual(deduplicator.clusters, [ ['a', 'c'], ['b', 'd', 'f'] ])
+        self.assertEqual(deduplicator.remapping.items(), [ ('c', 'a'), ('d', 'b'), ('f', 'b') ])
+        self.assertEqual(
+            sorted( reason for a, b, reason in deduplicator.get_reasons('f') ), [ 'eprint', 'title' ]
+            )
+        self.assertEqual(deduplicator.format_remapping().split('\n')[0], 'c\ta')
 
+    def test_conflicting_cluster(self):
+        formatter = texhelp.BibFormatter(cms_style=False)
+        title = 'Observation of a new boson at a mass of 125 GeV'
+        raws = [
+            '@article{{A,\n    title = "{0}",\n    doi = "10.1000/x"\n    }}'.format(title),
+            '@article{{G,\n    title = "{0}"\n    }}'.format(title),
+            '@article{{E,\n    title = "{0}",\n    doi = "10.1000/y"\n    }}'.format(title),
+            # Same eprint, but different dois
+            '@article{P,\n    title = "One",\n    eprint = "1207.7235",\n    doi = "10.1000/p"\n    }',
+            '@article{Q,\n    title = "Two",\n    eprint = "1207.7235",\n    doi = "10.1000/q"\n    }',
+            ]
+        citations = [ formatter.get_citation(raw) for raw in raws ]
+        deduplicator = texhelp.BibDeduplicator().add_citations(citations).process()
+        self.assertEqual(deduplicator.clusters, [ ['A', 'G'] ])
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+import os
+import sys
+import subprocess
+
+
+class TestLazyPackage(TestCase):
+
+    def run_python(self, code):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        return subprocess.check_output([ sys.executable, '-c', code ], env=env).split()
+
+    def test_import(self):
+        code = (
+            'import sys, texhelp\n'
+            'print sorted( m for m in sys.modules if m.startswith("texhelp.") and sys.modules[m] )\n'
+            'texhelp.TexProject\n'
+            'print "texhelp.tex_index" in sys.modules, "texhelp.bib_formatter" in sys.modules\n'
+            'texhelp.profiling.add_profile_arguments\n'
+            'print "geninterp" in sys.modules\n'
+            )
+        self.assertEqual(self.run_python(code), [ '[]', 'True', 'False', 'False' ])
+
+    def test_attributes(self):
+        import texhelp
+        import texhelp.xref
+        self.assertIs(texhelp.XRefIndex, texhelp.xref.XRefIndex)
+        self.assertIn('open_project', dir(texhelp))
+        with self.assertRaises(AttributeError):
+            texhelp.NoSuchName
+
+    def test_import_all(self):
+        namespace = {}
+        exec 'from texhelp import *' in namespace
+        self.assertIn('BibTexMatcher', namespace)
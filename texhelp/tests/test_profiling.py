@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from StringIO import StringIO
+
+import texhelp
+
+
+class TestProfiler(TestCase):
+
+    def test_stages(self):
+        raw = '@article{a,\n    title = "Some Title",\n    year = "2014"\n    }'
+        original = texhelp.BibFormatter.get_citation
+        stream = StringIO()
+        profiler = texhelp.Profiler(stream=stream).start()
+        texhelp.BibFormatter().get_citation(raw)
+        profiler.stop()
+
+        self.assertEqual(profiler.stages['citation formatting'].calls, 1)
+        self.assertEqual(profiler.stages['field splitting'].calls, 1)
+        formatting = profiler.stages['citation formatting']
+        self.assertTrue(formatting.own <= formatting.total)
+        self.assertTrue(profiler.stages['CMS checks'].total <= formatting.total)
+        self.assertTrue(stream.getvalue().startswith('texhelp profile:'))
+        # Everything is unwrapped again
+        self.assertEqual(texhelp.BibFormatter.get_citation, original)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+import texhelp
+import os
+import time
+import shutil
+import threading
+import tempfile
+
+
+class TestTexScanner(TestCase):
+
+    def records(self, text, *names):
+        return [ (r[0], r[3]) for r in texhelp.scan_tex(text).gen_records(*names) ]
+
+    def test_comments(self):
+        text = 'a\\cite{x}b % \\cite{y}\n50\\% \\cite{z} \\\\% \\cite{w}\n\\cite{bb%cc\nbb}'
+        self.assertEqual(
+            self.records(text, 'cite'), [('cite', 'x'), ('cite', 'z'), ('cite', 'bbbb')]
+            )
+
+    def test_nested(self):
+        text = (
+            '\\section*{Results \\cite{a}}\n'
+            '\\begin{figure}\\includegraphics[width=\\textwidth]{img/p}\n'
+            '\\caption{Plot \\cite{b}.}\\label{fig:p}\\end{figure}'
+            )
+        self.assertEqual(
+            self.records(text, 'section', 'cite', 'includegraphics', 'caption', 'label'),
+            [
+                ('section', 'Results \\cite{a}'), ('cite', 'a'), ('includegraphics', 'img/p'),
+                ('caption', 'Plot \\cite{b}.'), ('cite', 'b'), ('label', 'fig:p'),
+                ]
+            )
+        figure, = texhelp.scan_tex(text).gen_records('figure')
+        self.assertEqual(text[figure[1]:figure[2]][-12:], '\\end{figure}')
+
+    def test_refs(self):
+        text = '\\label{a}\\ref{a} \\eqref{ b }\\autoref{c}\\cref{a,b}\\refstepcounter{x}\\pageref{d}'
+        self.assertEqual(
+            self.records(text, 'label', *texhelp.tex_scanner.REF_DIRECTIVES),
+            [('label', 'a'), ('ref', 'a'), ('eqref', 'b'), ('autoref', 'c'), ('cref', 'a,b')]
+            )
+
+    def test_includes(self):
+        text = '\\input{a}\\import{dir/}{b}\n\\subimport{sub/}\n{c}'
+        self.assertEqual(
+            self.records(text, 'input', 'import', 'subimport'),
+            [('input', 'a'), ('import', ('dir/', 'b')), ('subimport', ('sub/', 'c'))]
+            )
+
+
+class TestTexProject(TestCase):
+
+    files = {
+        'main.tex' : '\\section{A}\\input{macros}\\import{chapters/}{intro}\\label{a}',
+        'macros.tex' : '\\newcommand{\\foo}{bar}',
+        'chapters/intro.tex' : '\\subsection{B}\\subimport{intro/}{details}',
+        'chapters/intro/details.tex' : '\\label{b}\\input{macros}\\cite{c}',
+        }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for relpath, text in self.files.items():
+            self.write(relpath, text)
+        self.main = os.path.join(self.tmpdir, 'main.tex')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, relpath, text):
+        path = os.path.join(self.tmpdir, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(text)
+
+    def test_tree(self):
+        project = texhelp.TexProject(self.main)
+        self.assertEqual(
+            [ os.path.relpath(node.path, self.tmpdir) for node in project.gen_nodes() ],
+            [ 'main.tex', 'macros.tex', 'chapters/intro.tex', 'chapters/intro/details.tex', 'macros.tex' ]
+            )
+        self.assertEqual(
+            [ record[3] for node, record in project.gen_records('label') ], ['b', 'a']
+            )
+        self.assertEqual(project.render_structure(), 'A\n    B')
+
+    def test_persistent_index(self):
+        self.assertEqual(texhelp.open_project(self.main, persistent=True).index.n_scanned, 4)
+        self.assertEqual(texhelp.open_project(self.main, persistent=True).index.n_scanned, 0)
+        # Make sure the mtime changes
+        time.sleep(0.01)
+        self.write('chapters/intro/details.tex', '\\label{c}')
+        project = texhelp.open_project(self.main, persistent=True)
+        self.assertEqual(project.index.n_scanned, 1)
+        self.assertEqual(
+            [ record[3] for node, record in project.gen_records('label') ], ['c', 'a']
+            )
+
+    def test_xref(self):
+        self.write('chapters/intro/details.tex', '\\label{b}\\ref{a}\\cref{b, c}\\label{d}\\label{b}')
+        xref = texhelp.XRefIndex.from_project(texhelp.TexProject(self.main))
+        details = os.path.join(self.tmpdir, 'chapters/intro/details.tex')
+        self.assertEqual(
+            xref.get_duplicate_labels(), [ ('b', [ (details, 0), (details, 36) ]) ]
+            )
+        self.assertEqual(xref.get_dangling_refs(), [ ('c', [ ('cref', (details, 16)) ]) ])
+        self.assertEqual([ label for label, locations in xref.get_unreferenced_labels() ], [ 'd' ])
+
+    def test_flat_tree(self):
+        self.write('chapters/intro/details.tex', '\\label{b}\\input{macros}\\caption{x \\cite{c}}')
+        tree = texhelp.FlatTexInterpreter().interpret_file(self.main)
+        cite, = tree.gen_blocks_by_name('cite')
+        self.assertEqual(cite.get_text(), '\\cite{c}')
+        self.assertEqual(cite.get_text_no_tags(), 'c')
+        self.assertEqual(cite.parent.name, 'caption')
+        ancestors = []
+        block = cite.parent
+        while not(block is None):
+            ancestors.append(block.name)
+            block = block.parent
+        self.assertEqual(ancestors, [ 'caption', 'file', 'subimport', 'file', 'import', 'file' ])
+        self.assertEqual(cite.depth(), 6)
+        self.assertEqual(tree.render_structure(), texhelp.TexProject(self.main).render_structure())
+        self.assertEqual([ block.get_text_no_tags() for block in tree.gen_blocks_by_name('label') ], ['b', 'a'])
+        details = os.path.join(self.tmpdir, 'chapters/intro/details.tex')
+        self.assertEqual(texhelp.XRefIndex.from_tree(tree, self.main).labels['b'], [ (details, 0) ])
+        matcher = texhelp.BibTexMatcher([ tree ], []).process()
+        self.assertEqual(matcher.cites['c'], [ (details, 34) ])
+        self.assertEqual(list(tree.gen_blocks_by_name('bracket')), [])
+        self.assertEqual(
+            [ block.get_text_no_tags() for name in [ 'import', 'subimport' ] for block in tree.gen_blocks_by_name(name) ],
+            [ 'chapters/intro', 'intro/details' ]
+            )
+
+        tree = texhelp.FlatTexInterpreter(brackets=True).interpret_file(self.main)
+        self.assertEqual(
+            [ block.get_text_no_tags() for block in tree.gen_blocks_by_name('bracket') if block.path.endswith('macros.tex') ],
+            [ '\\foo', 'bar' ] * 2
+            )
+        self.assertEqual(len(list(tree.gen_blocks_by_name('cite'))), 1)
+
+    def test_report(self):
+        self.write('chapters/intro/details.tex', '\\begin{figure}\\input{plot}\\end{figure}\\cite{c, d}')
+        self.write('chapters/intro/plot.tex', '\\includegraphics{p}\\label{fig:p}')
+        records = list(texhelp.gen_report_records(texhelp.TexProject(self.main)))
+        self.assertEqual(records[0]['type'], 'document')
+        self.assertEqual(
+            [ (r['type'], r.get('figure')) for r in records if r['type'] in [ 'image', 'label', 'cite' ] ],
+            [ ('image', 1), ('label', 1), ('cite', None), ('cite', None), ('label', None) ]
+            )
+        summary = records[-1]
+        self.assertEqual(summary['type'], 'summary')
+        self.assertEqual(summary['files'], 5)
+        self.assertEqual(summary['input'], 4)
+        self.assertEqual(summary['cite'], 2)
+
+
+class TestProjectWatcher(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.write('main.tex', '\\section{A}\\label{a}\\cite{x}\\input{part}')
+        self.write('part.tex', '\\section{B}\\label{b}')
+        self.write('refs.bib', '@article{x,\n    year = "2014"\n    }')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, relpath):
+        return os.path.join(self.tmpdir, relpath)
+
+    def write(self, relpath, text):
+        with open(self.path(relpath), 'w') as fp:
+            fp.write(text)
+        # Make the change visible to mtime checks
+        st = os.stat(self.path(relpath))
+        os.utime(self.path(relpath), (st.st_atime, st.st_mtime + 1))
+
+    def test_update(self):
+        watcher = texhelp.ProjectWatcher(self.path('main.tex'), [ self.path('refs.bib') ])
+        watcher.update()
+        self.assertEqual(watcher.reports['missing cites'], [])
+        self.assertEqual(watcher.reports['structure'], [ 'A', 'B' ])
+        self.assertEqual(watcher.get_paths(), sorted([ self.path(p) for p in [ 'main.tex', 'part.tex', 'refs.bib' ] ]))
+
+        self.write('part.tex', '\\section{B}\\label{a}\\cite{y}')
+        n_scanned = watcher.index.n_scanned
+        lines = watcher.update()
+        # Only the changed file is scanned again
+        self.assertEqual(watcher.index.n_scanned, n_scanned + 1)
+        self.assertEqual(watcher.reports['missing cites'], [ 'y (part.tex:20)' ])
+        self.assertEqual(watcher.reports['duplicate labels'], [ 'a (main.tex:11, part.tex:11)' ])
+        self.assertTrue('+y (part.tex:20)' in lines)
+        self.assertFalse('--- structure' in lines)
+
+    def test_polling(self):
+        watcher = texhelp.watch.PollingWatcher()
+        paths = [ self.path('main.tex'), self.path('part.tex') ]
+        self.assertEqual(watcher.poll(paths), [])
+        self.write('part.tex', '')
+        self.assertEqual(watcher.poll(paths), [ self.path('part.tex') ])
+        self.assertEqual(watcher.poll(paths), [])
+        # Saved after the previous poll, while the caller was busy
+        self.write('main.tex', '')
+        self.assertEqual(watcher.wait(paths), [ self.path('main.tex') ])
+
+    def test_polling_start(self):
+        watcher = texhelp.watch.PollingWatcher()
+        watcher.start([ self.path('main.tex') ])
+        self.write('main.tex', '')
+        # A later start adds the new paths without dropping the change to main.tex
+        watcher.start([ self.path('main.tex'), self.path('part.tex') ])
+        self.write('part.tex', '')
+        self.assertEqual(
+            watcher.wait([ self.path('main.tex'), self.path('part.tex') ]),
+            [ self.path('main.tex'), self.path('part.tex') ]
+            )
+
+
+class SlowTexIndex(texhelp.TexIndex):
+    """TexIndex whose reads take latency seconds, like opens on a network file system"""
+
+    latency = 0.02
+
+    def __init__(self):
+        super(SlowTexIndex, self).__init__()
+        self.lock = threading.Lock()
+        self.n_reading = 0
+        # Largest number of reads that were under way at the same time
+        self.max_reading = 0
+
+    def read(self, path):
+        with self.lock:
+            self.n_reading += 1
+            self.max_reading = max(self.max_reading, self.n_reading)
+        try:
+            time.sleep(self.latency)
+            return super(SlowTexIndex, self).read(path)
+        finally:
+            with self.lock:
+                self.n_reading -= 1
+
+
+class TestPrefetcher(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        main = []
+        for i_chapter in xrange(6):
+            main.append('\\section{{C{0}}}\\import{{ch{0}/}}{{chapter}}'.format(i_chapter))
+            chapter = [ '\\subsection{{P{0}}}\\subimport{{}}{{part{0}}}\\cite{{c{0}}}'.format(i) for i in xrange(3) ]
+            self.write('ch{0}/chapter.tex'.format(i_chapter), '\n'.join(chapter))
+            for i_part in xrange(3):
+                self.write('ch{0}/part{1}.tex'.format(i_chapter, i_part), '\\label{{l{0}{1}}}'.format(i_chapter, i_part))
+        self.write('main.tex', '\n'.join(main) + '\\input{missing}')
+        self.main = os.path.join(self.tmpdir, 'main.tex')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, relpath, text):
+        path = os.path.join(self.tmpdir, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(text)
+
+    def records(self, project):
+        return [ (node.path, record) for node, record in project.gen_records('section', 'subsection', 'cite', 'label') ]
+
+    def test_latency(self):
+        serial_index = SlowTexIndex()
+        serial = texhelp.TexProject(self.main, serial_index)
+
+        index = SlowTexIndex()
+        with texhelp.Prefetcher(8, index.read) as prefetcher:
+            prefetched = texhelp.TexProject(self.main, index, prefetcher)
+
+        self.assertEqual(self.records(prefetched), self.records(serial))
+        self.assertEqual(len(prefetched.missing), 1)
+        self.assertEqual(index.n_scanned, 25)
+        # Reads overlap instead of running one after another
+        self.assertEqual(serial_index.max_reading, 1)
+        self.assertTrue(index.max_reading > 1, index.max_reading)
+
+    def test_cached(self):
+        index = texhelp.TexIndex()
+        texhelp.TexProject(self.main, index)
+        self.write('ch2/part1.tex', '\\label{changed}')
+        os.utime(os.path.join(self.tmpdir, 'ch2/part1.tex'), (0, 0))
+        reads = []
+        def read(path):
+            reads.append(os.path.relpath(path, self.tmpdir))
+            return index.read(path)
+        with texhelp.Prefetcher(4, read) as prefetcher:
+            project = texhelp.TexProject(self.main, index, prefetcher)
+        # Unchanged files are not read again
+        self.assertEqual(reads, [ 'ch2/part1.tex' ])
+        self.assertTrue('changed' in [ record[3] for node, record in project.gen_records('label') ])
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import os
+from array import array
+
+from tex_scanner import SECTION_NAMES, INCLUDE_DIRECTIVES, _GROUP_TOKEN_RE, _skip_comment
+from tex_index import TexIndex, TexProject
+
+#____________________________________________________________________
+# Parse tree stored in parallel arrays instead of one object per block
+
+
+def scan_brackets(text):
+    """Returns (i_begin, i_end) of every {...} group outside comments, in order of i_begin"""
+    groups = []
+    stack = []
+    search = _GROUP_TOKEN_RE.search
+    pos = 0
+    while True:
+        match = search(text, pos)
+        if match is None: break
+        token = match.group()
+        pos = match.end()
+        if token == '{':
+            stack.append(len(groups))
+            groups.append([ match.start(), None ])
+        elif token == '}':
+            if stack: groups[stack.pop()][1] = pos
+        elif token == '%':
+            pos = _skip_comment(text, pos)
+    # Unclosed groups run to the end of the text
+    return [ (i_begin, len(text) if i_end is None else i_end) for i_begin, i_end in groups ]
+
+
+class FlatBlock(object):
+    """View on one node of a FlatTexTree; mimics the blocks of a geninterp tree"""
+    __slots__ = ['tree', 'index']
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def block(self):
+        # Nodes and blocks are the same object
+        return self
+
+    @property
+    def name(self):
+        return self.tree.names[self.tree.types[self.index]]
+
+    @property
+    def i_begin(self):
+        return self.tree.begins[self.index]
+
+    @property
+    def i_end(self):
+        return self.tree.ends[self.index]
+
+    @property
+    def path(self):
+        return self.tree.paths[self.tree.files[self.index]]
+
+    @property
+    def parent(self):
+        i_parent = self.tree.parents[self.index]
+        return None if i_parent < 0 else FlatBlock(self.tree, i_parent)
+
+    def depth(self):
+        depth = 0
+        i = self.tree.parents[self.index]
+        while i >= 0:
+            depth += 1
+            i = self.tree.parents[i]
+        return depth
+
+    def get_text(self):
+        return self.tree.get_file_text(self.tree.files[self.index])[self.i_begin:self.i_end]
+
+    def get_text_no_tags(self):
+        """
+        The argument, with comments removed; the joined path for import and
+        subimport, the text inside the braces for brackets
+        """
+        arg = self.tree.args[self.index]
+        if isinstance(arg, tuple): return os.path.join(*arg)
+        if not(arg is None): return arg
+        if self.name == 'bracket': return self.get_text()[1:-1]
+        return self.get_text()
+
+
+class FlatTexTree(object):
+    """
+    Parse tree of a tex document and everything it includes, as parallel
+    arrays: begin and end offset, block type id, parent index and file
+    index per node, in document order. Each file is a 'file' node whose
+    parent is the include directive that pulled it in.
+
+    Only directives that tex_scanner records become nodes, plus, with
+    brackets=True, every {...} group. File texts are only read when a
+    block's text is asked for.
+    """
+
+    def __init__(self, brackets=False):
+        super(FlatTexTree, self).__init__()
+        self.brackets = brackets
+        self.names = []
+        self.type_ids = {}
+        self.begins = array('l')
+        self.ends = array('l')
+        self.types = array('B')
+        self.parents = array('l')
+        self.files = array('l')
+        # Arguments of directives, None for other nodes
+        self.args = []
+        self.paths = []
+        self._texts = {}
+
+    def get_type_id(self, name):
+        type_id = self.type_ids.get(name)
+        if type_id is None:
+            type_id = self.type_ids[name] = len(self.names)
+            self.names.append(name)
+        return type_id
+
+    def add(self, name, i_begin, i_end, i_parent, i_file, arg=None):
+        self.begins.append(i_begin)
+        self.ends.append(i_end)
+        self.types.append(self.get_type_id(name))
+        self.parents.append(i_parent)
+        self.files.append(i_file)
+        self.args.append(arg)
+        return len(self.args) - 1
+
+    def __len__(self):
+        return len(self.args)
+
+    def get_file_text(self, i_file):
+        text = self._texts.get(i_file)
+        if text is None:
+            with open(self.paths[i_file], 'r') as fp:
+                text = self._texts[i_file] = fp.read()
+        return text
+
+    @classmethod
+    def from_project(cls, project, brackets=False):
+        tree = cls(brackets)
+        tree.add_file(project.root, -1)
+        return tree
+
+    def add_file(self, include_node, i_parent):
+        i_file = len(self.paths)
+        self.paths.append(include_node.path)
+        i_file_node = self.add('file', 0, os.path.getsize(include_node.path), i_parent, i_file)
+
+        intervals = [ (record[1], record[2], record) for record in include_node.scan.records ]
+        if self.brackets:
+            intervals.extend( (i_begin, i_end, None) for i_begin, i_end in scan_brackets(self.get_file_text(i_file)) )
+            # Enclosing intervals first
+            intervals.sort(key=lambda interval: (interval[0], -interval[1]))
+
+        # (i_end, node index) of the enclosing intervals
+        stack = [ (self.ends[i_file_node], i_file_node) ]
+        for i_begin, i_end, record in intervals:
+            while len(stack) > 1 and i_begin >= stack[-1][0]:
+                stack.pop()
+            if record is None:
+                i_node = self.add('bracket', i_begin, i_end, stack[-1][1], i_file)
+            else:
+                i_node = self.add(record[0], i_begin, i_end, stack[-1][1], i_file, record[3])
+            stack.append((i_end, i_node))
+            if not(record is None) and record[0] in INCLUDE_DIRECTIVES:
+                child = include_node.children.get(i_begin)
+                if not(child is None): self.add_file(child, i_node)
+
+    #____________________________________________________________________
+    # Queries, as on geninterp trees
+
+    def gen_blocks_by_name(self, name):
+        type_id = self.type_ids.get(name)
+        if type_id is None: return
+        types = self.types
+        for i in xrange(len(types)):
+            if types[i] == type_id:
+                yield FlatBlock(self, i)
+
+    def render_structure(self):
+        section_ids = dict( (self.type_ids[name], level) for level, name in enumerate(SECTION_NAMES) if name in self.type_ids )
+        lines = []
+        for i, type_id in enumerate(self.types):
+            if type_id in section_ids:
+                lines.append('    ' * section_ids[type_id] + self.args[i])
+        return '\n'.join(lines)
+
+
+class FlatTexInterpreter(object):
+    """
+    Interprets a document into a FlatTexTree; includes are followed as by
+    TexProject, and scans are kept in index. The --flat option of the
+    structure, labels and cites scripts uses it instead of TexInterpreter.
+
+    The tree answers the gen_blocks_by_name and render_structure queries of
+    a TexInterpreter tree for the directives that tex_scanner records
+    (sections, labels, refs, cites, captions, graphics and includes), plus
+    'file' nodes. BracketBlock nodes are skipped unless brackets=True;
+    other blocks, such as 'newcommand' or 'comment', have no nodes.
+    """
+
+    def __init__(self, brackets=False, index=None):
+        super(FlatTexInterpreter, self).__init__()
+        self.brackets = brackets
+        self.index = TexIndex() if index is None else index
+
+    def set_base_file(self, base_file):
+        # Includes resolve relative to the interpreted file, as in TexProject
+        pass
+
+    def interpret_file(self, path):
+        return FlatTexTree.from_project(TexProject(path, self.index), self.brackets)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import hashlib
+import cPickle as pickle
+
+from tex_scanner import scan_tex, resolve_include, SECTION_NAMES, INCLUDE_DIRECTIVES
+from prefetch import Prefetcher
+
+#____________________________________________________________________
+# Persistent index of per-file scans, and include trees built from it
+
+
+def default_index_path(main_file):
+    return os.path.join(os.path.dirname(os.path.abspath(main_file)), '.texhelp_index')
+
+
+class TexIndex(object):
+    """
+    Per-file TexScans, optionally stored on disk between runs.
+
+    A file is only read again when its mtime or size changed, and only
+    scanned again when its content hash changed as well. With path=None
+    the index lives in memory only.
+    """
+
+    # Bump whenever a change to tex_scanner changes its records
+    version = 2
+
+    def __init__(self, path=None):
+        super(TexIndex, self).__init__()
+        self.path = path
+        # abspath -> (mtime, size, sha1 digest, TexScan)
+        self.entries = {}
+        self.dirty = False
+        self.n_scanned = 0
+        if not(path is None): self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path): return
+        try:
+            with open(self.path, 'rb') as fp:
+                version, entries = pickle.load(fp)
+        except Exception as e:
+            logging.warning('Ignoring unreadable tex index {0}: {1}'.format(self.path, e))
+            return
+        if version == self.version:
+            self.entries = entries
+
+    def save(self):
+        if self.path is None or not(self.dirty): return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fp:
+            pickle.dump((self.version, self.entries), fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+        self.dirty = False
+
+    def is_fresh(self, path):
+        entry = self.entries.get(path)
+        if entry is None: return False
+        st = os.stat(path)
+        return entry[0] == st.st_mtime and entry[1] == st.st_size
+
+    def get_cached_scan(self, path):
+        """The stored scan of path if the file did not change, else None"""
+        entry = self.entries.get(path)
+        if entry is None or not self.is_fresh(path): return None
+        return entry[3]
+
+    def read(self, path):
+        with open(path, 'r') as fp:
+            return fp.read()
+
+    def get_scan(self, path, prefetcher=None):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.entries.get(path)
+        if not(entry is None) and entry[0] == st.st_mtime and entry[1] == st.st_size:
+            return entry[3]
+
+        if prefetcher is None:
+            text, scan = self.read(path), None
+        else:
+            text, scan = prefetcher.get(path)
+        digest = hashlib.sha1(text).digest()
+        if not(entry is None) and entry[2] == digest:
+            scan = entry[3]
+        else:
+            logging.debug('Scanning {0}'.format(path))
+            if scan is None: scan = scan_tex(text)
+            self.n_scanned += 1
+        self.entries[path] = (st.st_mtime, st.st_size, digest, scan)
+        self.dirty = True
+        return scan
+
+
+class IncludeNode(object):
+    """One file in the include tree of a TexProject"""
+
+    def __init__(self, path, scan, import_dir, parent=None, record=None):
+        super(IncludeNode, self).__init__()
+        self.path = path
+        self.scan = scan
+        # Directory that \import/\subimport made current, relative to the root
+        self.import_dir = import_dir
+        self.parent = parent
+        # The include record in the parent that pulled in this file
+        self.record = record
+        # i_begin of the include record -> IncludeNode
+        self.children = {}
+
+    def depth(self):
+        return 0 if self.parent is None else 1 + self.parent.depth()
+
+
+class TexProject(object):
+    """
+    Include tree of a main tex file, stitched together from per-file scans.
+
+    Includes resolve relative to the main file's directory, as by
+    tex_scanner.resolve_include.
+    """
+
+    def __init__(self, main_file, index=None, prefetcher=None):
+        super(TexProject, self).__init__()
+        self.main_file = os.path.abspath(main_file)
+        self.root_dir = os.path.dirname(self.main_file)
+        self.index = TexIndex() if index is None else index
+        # Optional texhelp.prefetch.Prefetcher that reads files ahead
+        self.prefetcher = prefetcher
+        if not(prefetcher is None):
+            prefetcher.start(self.main_file, self.resolve_include, self.index.get_cached_scan)
+        # (IncludeNode, record, resolved path) of includes that do not exist
+        self.missing = []
+        self.root = self.load_node(self.main_file, '.', None, None, [])
+
+    def resolve_include(self, record, import_dir):
+        """Returns (path, import_dir) of the file an include record pulls in"""
+        return resolve_include(record, import_dir, self.root_dir)
+
+    def load_node(self, path, import_dir, parent, record, stack):
+        node = IncludeNode(path, self.index.get_scan(path, self.prefetcher), import_dir, parent, record)
+        stack.append(path)
+        for child_record in node.scan.gen_records(*INCLUDE_DIRECTIVES):
+            child_path, child_import_dir = self.resolve_include(child_record, import_dir)
+            if not os.path.isfile(child_path):
+                logging.warning('{0} includes non-existing file {1}'.format(path, child_path))
+                self.missing.append((node, child_record, child_path))
+            elif child_path in stack:
+                logging.error(
+                    'Include cycle: {0}'.format(' -> '.join(stack[stack.index(child_path):] + [child_path]))
+                    )
+            else:
+                node.children[child_record[1]] = self.load_node(
+                    child_path, child_import_dir, node, child_record, stack
+                    )
+        stack.pop()
+        return node
+
+    def gen_nodes(self, node=None):
+        """Yields all IncludeNodes in document order"""
+        if node is None: node = self.root
+        yield node
+        for record in node.scan.gen_records(*INCLUDE_DIRECTIVES):
+            child = node.children.get(record[1])
+            if not(child is None):
+                for descendant in self.gen_nodes(child):
+                    yield descendant
+
+    def gen_records(self, *names):
+        """Yields (IncludeNode, record) for records with one of the names, in document order"""
+        return self._gen_records(self.root, set(names))
+
+    def _gen_records(self, node, names):
+        for record in node.scan.records:
+            if record[0] in names:
+                yield node, record
+            if record[0] in INCLUDE_DIRECTIVES:
+                child = node.children.get(record[1])
+                if not(child is None):
+                    for item in self._gen_records(child, names):
+                        yield item
+
+    def get_paths(self):
+        return set( node.path for node in self.gen_nodes() )
+
+    def render_structure(self):
+        lines = []
+        for node, record in self.gen_records(*SECTION_NAMES):
+            lines.append('    ' * SECTION_NAMES.index(record[0]) + record[3])
+        return '\n'.join(lines)
+
+
+def open_project(main_file, persistent=False, prefetch=0):
+    """
+    Returns the TexProject of main_file. If persistent, the index next to
+    main_file is used and updated, so unchanged files are not parsed again.
+    With prefetch > 0, files are read ahead on that many threads.
+    """
+    index = TexIndex(default_index_path(main_file) if persistent else None)
+    if prefetch > 0:
+        with Prefetcher(prefetch, index.read) as prefetcher:
+            project = TexProject(main_file, index, prefetcher)
+        project.prefetcher = None
+    else:
+        project = TexProject(main_file, index)
+    index.save()
+    return project
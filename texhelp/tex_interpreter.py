@@ -3,22 +3,262 @@
 import geninterp
 import re
 import os
+import logging
+import threading
+import multiprocessing
+from itertools import islice
+
+from tex_scanner import scan_tex, resolve_include
+from prefetch import Prefetcher, read_file
+
+#____________________________________________________________________
+# Dispatching of block openings
+
+class TagDispatcher(object):
+    """
+    Prefix trie of the open_tags of all registered block classes.
+
+    Instead of comparing its open_tag at every index, a block class asks the
+    dispatcher; a single walk over a text finds the openings of all
+    registered classes, after which open is a set lookup. The openings are
+    kept per text in the ParseContext of the parse under way, so a text is
+    walked once however many includes interrupt its parse, and the last
+    text of every thread is looked up first.
+    """
+
+    def __init__(self):
+        super(TagDispatcher, self).__init__()
+        self.classes = []
+        # char -> (classes whose open_tag ends here, {char -> ...})
+        self.trie = {}
+        self._first_char_re = None
+        self.local = threading.local()
+
+    def register(self, cls):
+        node = None
+        children = self.trie
+        for c in cls.open_tag:
+            if not c in children: children[c] = ([], {})
+            node = children[c]
+            children = node[1]
+        node[0].append(cls)
+        self.classes.append(cls)
+        self._first_char_re = re.compile(
+            '[' + ''.join( re.escape(c) for c in sorted(self.trie) ) + ']'
+            )
+
+    def gen_openings(self, text):
+        """Yields (i, cls) for every index at which a registered class opens"""
+        trie = self.trie
+        n = len(text)
+        for match in self._first_char_re.finditer(text):
+            i = match.start()
+            node = trie[text[i]]
+            j = i
+            while True:
+                for cls in node[0]:
+                    if cls.escape_char is None or text[i-1] != cls.escape_char:
+                        yield i, cls
+                j += 1
+                if j == n or not node[1]: break
+                node = node[1].get(text[j])
+                if node is None: break
+
+    def scan(self, text):
+        """Returns {cls: set of indices at which cls opens} of text"""
+        positions = dict( (cls, set()) for cls in self.classes )
+        if not self.classes: return positions
+        for i, cls in self.gen_openings(text):
+            positions[cls].add(i)
+        return positions
+
+    def get_positions(self, cls, text):
+        """Set of indices at which cls opens in text"""
+        last = getattr(self.local, 'last', None)
+        if last is None or not(last[0] is text):
+            last = self.local.last = (text, self.lookup(text))
+        positions = last[1]
+        if not cls in positions:
+            # Registered after the text was walked
+            if not cls in self.classes: self.register(cls)
+            positions.update(self.scan(text))
+        return positions[cls]
+
+    def lookup(self, text):
+        """Openings of text, walked once per parse"""
+        interpreter = get_active_interpreter()
+        if interpreter is None or interpreter.context is None:
+            return self.scan(text)
+        # id -> (text, positions); the text is kept so that its id stays unique
+        cache = interpreter.context.open_positions
+        entry = cache.get(id(text))
+        if entry is None or not(entry[0] is text):
+            entry = cache[id(text)] = (text, self.scan(text))
+        return entry[1]
+
+    def opens(self, cls, text, i):
+        return i in self.get_positions(cls, text)
+
+
+dispatcher = TagDispatcher()
+
+
+class DispatchedOpenMixin(object):
+    """Replaces the per-index string comparison in open by a TagDispatcher lookup"""
+
+    @classmethod
+    def open(cls, text, i):
+        # Fast path for the last text of the thread
+        last = getattr(dispatcher.local, 'last', None)
+        if not(last is None) and last[0] is text:
+            positions = last[1].get(cls)
+            if not(positions is None): return i in positions
+        return dispatcher.opens(cls, text, i)
 
 #____________________________________________________________________
 # TeX blocks and interpreters
 
-class BracketBlock(geninterp.blocks.OpenCloseTagBlock):
+class BracketBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'bracket'
     open_tag = '{'
     close_tag = '}'
     escape_char = '\\'
 
-class CommentBlock(geninterp.blocks.CommentBlock):
+class CommentBlock(DispatchedOpenMixin, geninterp.blocks.CommentBlock):
     name = 'comment'
     open_tag = '%'
     escape_char = '\\'
 
-class InputBlock(geninterp.blocks.InputBlock):
+# Include directives that the interpreter follows; \include has no block
+INTERPRETED_INCLUDES = [ 'input', 'import', 'subimport' ]
+# Include directives that resolve relative to the import directory
+IMPORT_DIR_INCLUDES = [ 'input', 'subimport' ]
+
+def uses_import_dir(records):
+    """Whether the subtree of a file with these include records depends on its import directory"""
+    return any( record[0] in IMPORT_DIR_INCLUDES for record in records )
+
+
+class ParseContext(object):
+    """
+    State of one outermost parse: the files that are being parsed, outermost
+    first, and the \\import directory each of them was pulled in with.
+    \\subimport resolves relative to the import directory of the file it is in.
+    Includes resolve relative to base_dir, by default the directory of path.
+    Included files are read by prefetcher, if any.
+    """
+
+    def __init__(self, path, base_dir=None, prefetcher=None):
+        super(ParseContext, self).__init__()
+        self.base_dir = os.path.dirname(path) if base_dir is None else base_dir
+        self.include_stack = [ path ]
+        self.import_dirs = [ '.' ]
+        # Whether the subtree of each file on the stack depends on its import
+        # directory, which is the case if the file has an \\input or \\subimport
+        self.uses_import_dirs = [ False ]
+        self.prefetcher = prefetcher
+        # Block openings per parsed text, see TagDispatcher
+        self.open_positions = {}
+
+    @property
+    def import_dir(self):
+        return self.import_dirs[-1]
+
+    def push(self, path, import_dir):
+        self.include_stack.append(path)
+        self.import_dirs.append(import_dir)
+        self.uses_import_dirs.append(False)
+
+    def pop(self):
+        """Returns whether the subtree of the popped file depends on its import directory"""
+        self.include_stack.pop()
+        self.import_dirs.pop()
+        return self.uses_import_dirs.pop()
+
+    def resolve_record(self, record, import_dir):
+        """
+        Returns (path, import_dir) of a tex_scanner include record, resolved
+        as by TexProject; import_dir is that of the including file
+        """
+        return resolve_include(record, import_dir, self.base_dir)
+
+
+# The outermost interpreter that is parsing a file in this thread; its parse
+# cache and ParseContext are used by the include blocks of all subinterpreters
+_active = threading.local()
+
+def get_active_interpreter():
+    return getattr(_active, 'interpreter', None)
+
+
+def get_import_dir():
+    """Import directory of the file that is being parsed; '.' outside of a parse"""
+    interpreter = get_active_interpreter()
+    if interpreter is None or interpreter.context is None: return '.'
+    return interpreter.context.import_dir
+
+
+def get_parsed_path():
+    """Path of the file that is being parsed; None outside of interpret_file"""
+    interpreter = get_active_interpreter()
+    if interpreter is None or interpreter.context is None: return None
+    return interpreter.context.include_stack[-1]
+
+
+class ParsedFileMixin(object):
+    """Keeps the path of the file the block is in, which offsets are relative to"""
+
+    def __init__(self, *args, **kwargs):
+        super(ParsedFileMixin, self).__init__(*args, **kwargs)
+        self.path = get_parsed_path()
+
+
+class SharedSubtreeMixin(object):
+    """
+    Parses every included file only once per BaseTexInterpreter, and refuses
+    to follow an include that leads back to a file that is being parsed.
+    Every include site of a file gets the same subtree object; subtrees that
+    depend on their import directory are kept per (path, import_dir).
+    """
+
+    def get_include_arg(self, relpath_file=None):
+        """Argument of the tex_scanner record of this include"""
+        return self.get_text_no_tags() if relpath_file is None else relpath_file
+
+    def run_subinterpreter(self, relpath_file=None):
+        interpreter = get_active_interpreter()
+        if interpreter is None:
+            return super(SharedSubtreeMixin, self).run_subinterpreter(relpath_file)
+
+        context = interpreter.context
+        path, import_dir = context.resolve_record(
+            (self.name, self.i_begin, None, self.get_include_arg(relpath_file)), context.import_dir
+            )
+        if self.name in IMPORT_DIR_INCLUDES: context.uses_import_dirs[-1] = True
+        if path in context.include_stack:
+            raise ValueError(
+                'Include cycle: {0}'.format(
+                    ' -> '.join(context.include_stack[context.include_stack.index(path):] + [path])
+                    )
+                )
+        cache = interpreter.subtree_cache
+        key = path if path in cache else (path, import_dir)
+        if not key in cache:
+            context.push(path, import_dir)
+            # geninterp appends the extension itself; an absolute path makes it
+            # open the file resolved here
+            if path.endswith(self.extension): path_file = path[:-len(self.extension)]
+            else: path_file = path
+            try:
+                subtree = super(SharedSubtreeMixin, self).run_subinterpreter(path_file)
+            finally:
+                uses = context.pop()
+            key = (path, import_dir) if uses else path
+            cache[key] = subtree
+        return cache[key]
+
+
+class InputBlock(SharedSubtreeMixin, DispatchedOpenMixin, geninterp.blocks.InputBlock):
     name = 'input'
     open_tag = '\\input{'
     close_tag = '}'
@@ -26,7 +266,11 @@ class InputBlock(geninterp.blocks.InputBlock):
     escape_char = '\\'
 
 
-class ImportBlock(geninterp.blocks.InputBlock):
+# Matched with pattern.match(text, pos), which does not copy the text
+_BRACE_GROUP_RE = re.compile(r'\{.*?\}')
+_SQUARE_BRACKETS_RE = re.compile(r'\[.*?\]')
+
+class ImportBlock(SharedSubtreeMixin, DispatchedOpenMixin, geninterp.blocks.InputBlock):
     name = 'import'
     open_tag = '\\import{'
     close_tag = '}'
@@ -34,27 +278,29 @@ class ImportBlock(geninterp.blocks.InputBlock):
     escape_char = '\\'
     close_immediately = True
 
-    _latest_import_relpath = '.'
-
     def __init__(self, i_begin, text):
         super(ImportBlock, self).__init__(i_begin, text)
 
-        # Assume no comments
-        look_ahead_segment = self.text[i_begin+len(self.open_tag)-1:i_begin+1000]
-        self.matches = re.findall(r'\{.*?\}', look_ahead_segment)[:2]
+        # Assume no comments; the arguments are matched in place rather than
+        # in a copied look-ahead segment
+        i_arg = i_begin+len(self.open_tag)-1
+        self.matches = [
+            match.group() for match in islice(_BRACE_GROUP_RE.finditer(self.text, i_arg, i_begin+1000), 2)
+            ]
         if len(self.matches) != 2:
             raise ValueError(
                 'Error parsing ImportBlock: {0} matches, look_ahead_segment is:\n{1}'
-                .format(len(self.matches), look_ahead_segment)
+                .format(len(self.matches), self.text[i_arg:i_begin+1000])
                 )
-        self.relpath_file = os.path.join(
-            self.matches[0].replace('{','').replace('}',''), self.matches[1].replace('{','').replace('}','')
-            )
+        # Directory the included file's own \subimports are relative to
+        self.import_dir = self.get_import_dir(self.matches[0].replace('{','').replace('}',''))
+        self.relpath_file = os.path.join(self.import_dir, self.matches[1].replace('{','').replace('}',''))
 
-        if self.name == 'import':
-            # For SubImports, also record what the latest Import was
-            ImportBlock._latest_import_relpath = self.matches[0].replace('{','').replace('}','')
+    def get_import_dir(self, arg):
+        return os.path.normpath(arg)
 
+    def get_include_arg(self, relpath_file=None):
+        return tuple( match.replace('{','').replace('}','') for match in self.matches )
 
     def process(self, text=None):
         return self.open_tag[-1] + self.matches[0] + self.matches[1]
@@ -75,63 +321,92 @@ class SubImportBlock(ImportBlock):
     escape_char = '\\'
     close_immediately = True
 
-    def __init__(self, i_begin, text):
-        super(SubImportBlock, self).__init__(i_begin, text)
-        self.relpath_file = os.path.join(ImportBlock._latest_import_relpath, self.relpath_file)
+    def get_import_dir(self, arg):
+        # Relative to the import directory of the file the \subimport is in
+        return os.path.normpath(os.path.join(get_import_dir(), arg))
 
 
-
-class CiteBlock(geninterp.blocks.OpenCloseTagBlock):
+class CiteBlock(ParsedFileMixin, DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'cite'
     open_tag = '\\cite{'
     close_tag = '}'
     escape_char = '\\'
 
-class SectionBlock(geninterp.blocks.OpenCloseTagBlock):
+class LabelBlock(ParsedFileMixin, DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
+    name = 'label'
+    open_tag = '\\label{'
+    close_tag = '}'
+    escape_char = '\\'
+
+class RefBlock(ParsedFileMixin, DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
+    name = 'ref'
+    open_tag = '\\ref{'
+    close_tag = '}'
+    escape_char = '\\'
+
+class EqRefBlock(ParsedFileMixin, DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
+    name = 'eqref'
+    open_tag = '\\eqref{'
+    close_tag = '}'
+    escape_char = '\\'
+
+class AutoRefBlock(ParsedFileMixin, DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
+    name = 'autoref'
+    open_tag = '\\autoref{'
+    close_tag = '}'
+    escape_char = '\\'
+
+class CRefBlock(ParsedFileMixin, DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
+    name = 'cref'
+    open_tag = '\\cref{'
+    close_tag = '}'
+    escape_char = '\\'
+
+class SectionBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'section'
     open_tag = '\\section{'
     close_tag = '}'
     escape_char = '\\'
 
-class SubSectionBlock(geninterp.blocks.OpenCloseTagBlock):
+class SubSectionBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'subsection'
     open_tag = '\\subsection{'
     close_tag = '}'
     escape_char = '\\'
 
-class SubSubSectionBlock(geninterp.blocks.OpenCloseTagBlock):
+class SubSubSectionBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'subsubsection'
     open_tag = '\\subsubsection{'
     close_tag = '}'
     escape_char = '\\'
 
-class SubSubSubSectionBlock(geninterp.blocks.OpenCloseTagBlock):
+class SubSubSubSectionBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'subsubsubsection'
     open_tag = '\\subsubsubsection{'
     close_tag = '}'
     escape_char = '\\'
 
 
-class NewCommandBlock(geninterp.blocks.OpenCloseTagBlock):
+class NewCommandBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'newcommand'
     open_tag = '\\newcommand{'
     close_tag = '}'
     escape_char = '\\'
 
-class ProvideCommandBlock(geninterp.blocks.OpenCloseTagBlock):
+class ProvideCommandBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'providecommand'
     open_tag = '\\providecommand{'
     close_tag = '}'
     escape_char = '\\'
 
 
-class FigureBlock(geninterp.blocks.OpenCloseTagBlock):
+class FigureBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'figure'
     open_tag = '\\begin{figure}'
     close_tag = '\\end{figure}'
     escape_char = '\\'
 
-class IncludeGraphicsBlock(geninterp.blocks.OpenCloseTagBlock):
+class IncludeGraphicsBlock(DispatchedOpenMixin, geninterp.blocks.OpenCloseTagBlock):
     name = 'includegraphics'
     open_tag = '\\includegraphics'
     close_tag = '}'
@@ -141,8 +416,8 @@ class IncludeGraphicsBlock(geninterp.blocks.OpenCloseTagBlock):
         self.square_brackets = ''
         r = len(self.open_tag)
         if self.text[self.i_begin+len(self.open_tag)] == '[':
-            text = self.text[self.i_begin+len(self.open_tag):]
-            self.square_brackets = re.match(r'\[.*?\]', text).group()
+            match = _SQUARE_BRACKETS_RE.match(self.text, self.i_begin+len(self.open_tag))
+            self.square_brackets = match.group()
             r += len(self.square_brackets) + 1
         return r
 
@@ -165,9 +440,158 @@ class BaseTexInterpreter(geninterp.Interpreter):
         SubImportBlock,
         ]
 
+    def __init__(self, *args, **kwargs):
+        super(BaseTexInterpreter, self).__init__(*args, **kwargs)
+        # Up front, so that the first text is not walked again for every block
+        for cls in self.blocks:
+            if issubclass(cls, DispatchedOpenMixin) and not cls in dispatcher.classes:
+                dispatcher.register(cls)
+        self.base_dir = None
+        # Resolved absolute path, or (path, import_dir) for subtrees that
+        # depend on their import directory -> parsed subtree
+        self.subtree_cache = {}
+        # Whether the last parsed file depends on its import directory
+        self.root_uses_import_dir = False
+        # ParseContext of the parse that is under way, if any
+        self.context = None
+        # With prefetch > 0, included files are read ahead on that many threads
+        self.prefetch = 0
+        # read_file(path) returns the text of a file for the prefetcher
+        self.read_file = read_file
+        # With jobs > 1, independent subtrees are parsed in a process pool first
+        self.jobs = 1
+
+    def set_base_file(self, base_file):
+        super(BaseTexInterpreter, self).set_base_file(base_file)
+        self.base_dir = os.path.dirname(os.path.abspath(base_file))
+
+    def resolve_record(self, record, import_dir):
+        return self.context.resolve_record(record, import_dir)
+
+    def clear_cache(self):
+        self.subtree_cache = {}
+
+    def find_independent_subtrees(self, path):
+        """
+        Roots of the largest subtrees below path that parse the same on their
+        own, found by scanning the include graph with tex_scanner: subtrees
+        without include cycles whose root either does not depend on its
+        import directory or is pulled in with the import directory '.'
+        """
+        records = {}
+        def get_records(node_path):
+            if not node_path in records:
+                with open(node_path, 'r') as fp:
+                    records[node_path] = list(scan_tex(fp.read()).gen_records(*INTERPRETED_INCLUDES))
+            return records[node_path]
+
+        # (path, import_dir) -> [ child (path, import_dir) ]
+        children = {}
+        # (path, import_dir) -> whether the subtree has no include cycles
+        acyclic = {}
+        def visit(key, stack):
+            if key in acyclic: return acyclic[key]
+            if key[0] in stack: return False
+            children[key] = [ self.resolve_record(record, key[1]) for record in get_records(key[0]) ]
+            stack.append(key[0])
+            ok = True
+            for child in children[key]:
+                if os.path.isfile(child[0]) and not visit(child, stack): ok = False
+            stack.pop()
+            acyclic[key] = ok
+            return ok
+        visit((path, '.'), [])
+
+        roots = set()
+        seen = set([ (path, '.') ])
+        stack = [ (path, '.') ]
+        while stack:
+            for child in children[stack.pop()]:
+                if child in seen or not child in children: continue
+                seen.add(child)
+                if acyclic[child] and (child[1] == '.' or not uses_import_dir(get_records(child[0]))):
+                    roots.add(child[0])
+                else:
+                    stack.append(child)
+        return sorted(roots)
+
+    def parse_independent_subtrees(self, path):
+        """
+        Parses the independent subtrees below path on a pool of self.jobs
+        processes, and puts them in the parse cache, where the include blocks
+        of the parse of path pick them up. Subtrees that cannot be sent back
+        are left to the serial parse.
+        """
+        paths = [
+            p for p in self.find_independent_subtrees(path)
+            if not p in self.subtree_cache and not (p, '.') in self.subtree_cache
+            ]
+        if len(paths) < 2: return
+        pool = multiprocessing.Pool(min(self.jobs, len(paths)))
+        try:
+            results = [
+                (p, pool.apply_async(_parse_independent_subtree, (self.__class__, p, self.context.base_dir)))
+                for p in paths
+                ]
+            for p, result in results:
+                try:
+                    tree, uses, subtree_cache = result.get()
+                except Exception as e:
+                    logging.debug('Parsing {0} in a worker failed ({1}); parsing it serially'.format(p, e))
+                    continue
+                # Roots that depend on their import directory are pulled in with '.'
+                self.subtree_cache[(p, '.') if uses else p] = tree
+                for cached_path, subtree in subtree_cache.iteritems():
+                    self.subtree_cache.setdefault(cached_path, subtree)
+        finally:
+            pool.close()
+            pool.join()
+
+    def interpret_file(self, path, *args, **kwargs):
+        active = get_active_interpreter()
+        if not(active is None):
+            # A subinterpreter; the include block takes care of the bookkeeping
+            # and pushed the resolved path of the file
+            prefetcher = active.context.prefetcher
+            if prefetcher is None:
+                return super(BaseTexInterpreter, self).interpret_file(path, *args, **kwargs)
+            return self.interpret(prefetcher.get(active.context.include_stack[-1])[0])
+
+        abspath = os.path.abspath(path)
+        prefetcher = Prefetcher(self.prefetch, self.read_file) if self.prefetch > 0 else None
+        self.context = ParseContext(abspath, self.base_dir, prefetcher)
+        try:
+            if self.jobs > 1:
+                # Before becoming active, so that the workers start out clean
+                self.parse_independent_subtrees(abspath)
+            _active.interpreter = self
+            if not(prefetcher is None):
+                prefetcher.start(abspath, self.context.resolve_record)
+            return super(BaseTexInterpreter, self).interpret_file(path, *args, **kwargs)
+        finally:
+            if not(prefetcher is None): prefetcher.close()
+            self.root_uses_import_dir = self.context.uses_import_dirs[0]
+            self.context = None
+            _active.interpreter = None
+
+
+def _parse_independent_subtree(cls, path, base_dir):
+    # Runs in a worker process of BaseTexInterpreter.parse_independent_subtrees;
+    # returns the subtree and the subtrees of the files it includes
+    interpreter = cls()
+    interpreter.base_dir = base_dir
+    tree = interpreter.interpret_file(path)
+    return tree, interpreter.root_uses_import_dir, interpreter.subtree_cache
+
+
 class TexInterpreter(BaseTexInterpreter):
     blocks = BaseTexInterpreter.blocks + [
         CiteBlock,
+        LabelBlock,
+        RefBlock,
+        EqRefBlock,
+        AutoRefBlock,
+        CRefBlock,
         # 
         SectionBlock,
         SubSectionBlock,
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+
+#____________________________________________________________________
+# Single-pass scanner for the directives of a single tex file
+
+# Section levels in order of depth
+SECTION_NAMES = [ 'section', 'subsection', 'subsubsection', 'subsubsubsection' ]
+
+# Directives that refer to a \label; \cref takes a comma-separated list
+REF_DIRECTIVES = [ 'ref', 'eqref', 'autoref', 'cref' ]
+# Directives that take one {...} argument, optionally preceded by a * and
+# an [...] argument
+ONE_ARG_DIRECTIVES = SECTION_NAMES + REF_DIRECTIVES + [
+    'cite', 'label', 'caption', 'includegraphics', 'input', 'include',
+    ]
+# Directives that take two {...} arguments
+TWO_ARG_DIRECTIVES = [ 'import', 'subimport' ]
+# Directives that pull in another tex file
+INCLUDE_DIRECTIVES = [ 'input', 'include', 'import', 'subimport' ]
+# Directives whose argument is scanned for further directives
+CONTAINER_DIRECTIVES = SECTION_NAMES + [ 'caption' ]
+
+# A comment or a directive, not escaped by a backslash. Pairs of backslashes
+# (line breaks) in front of the token are consumed by the prefix group.
+_TOKEN_RE = re.compile(
+    r'(?<!\\)((?:\\\\)*)(?:%|\\(?:(begin|end)\{figure\*?\}|('
+    + '|'.join(ONE_ARG_DIRECTIVES + TWO_ARG_DIRECTIVES)
+    + r')(?![a-zA-Z])\*?\s*(?:\[[^\]]*\]\s*)?\{))'
+    )
+# What matters inside a {...} group
+_GROUP_TOKEN_RE = re.compile(r'\\.|[{}%]', re.S)
+_OPEN_GROUP_RE = re.compile(r'\s*\{')
+
+
+class TexScan(object):
+    """
+    Directives found in a single tex file, in document order.
+
+    Each record is a (name, i_begin, i_end, arg) tuple, with offsets into the
+    file's text. arg is the argument with comments removed; a (dir, file)
+    tuple for import and subimport, and None for figure environments.
+    """
+    __slots__ = ['records']
+
+    def __init__(self, records):
+        self.records = records
+
+    def __getstate__(self):
+        return (self.records,)
+
+    def __setstate__(self, state):
+        self.records, = state
+
+    def gen_records(self, *names):
+        for record in self.records:
+            if record[0] in names:
+                yield record
+
+
+def _skip_comment(text, i):
+    """Returns the index after the line break ending the comment at i"""
+    i_newline = text.find('\n', i)
+    return len(text) if i_newline == -1 else i_newline + 1
+
+
+def read_group(text, i):
+    """
+    Reads the {...} group whose opening brace is at text[i-1], and returns
+    (content, i_end) with comments removed from the content. Returns
+    (None, len(text)) if the group is not closed.
+    """
+    depth = 1
+    pieces = []
+    i_piece = i
+    pos = i
+    search = _GROUP_TOKEN_RE.search
+    while True:
+        match = search(text, pos)
+        if match is None:
+            return None, len(text)
+        token = match.group()
+        pos = match.end()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth == 0:
+                pieces.append(text[i_piece:match.start()])
+                return ''.join(pieces), pos
+        elif token == '%':
+            pieces.append(text[i_piece:match.start()])
+            pos = i_piece = _skip_comment(text, pos)
+
+
+def scan_tex(text):
+    """
+    Finds comments, sectioning, cites, labels, refs, captions, figures,
+    included graphics and included files in one regex-driven pass over text, and
+    returns a TexScan. Nothing inside comments is recorded.
+    """
+    records = []
+    open_figures = []
+    search = _TOKEN_RE.search
+    pos = 0
+    while True:
+        match = search(text, pos)
+        if match is None: break
+        i_begin = match.end(1)
+        pos = match.end()
+        figure, name = match.group(2, 3)
+
+        if figure is not None:
+            if figure == 'begin':
+                open_figures.append(len(records))
+                records.append(('figure', i_begin, None, None))
+            elif open_figures:
+                i_record = open_figures.pop()
+                records[i_record] = ('figure', records[i_record][1], pos, None)
+        elif name is None:
+            pos = _skip_comment(text, pos)
+        else:
+            i_arg = pos
+            arg, pos = read_group(text, i_arg)
+            if arg is None: break
+            if name in TWO_ARG_DIRECTIVES:
+                open_group = _OPEN_GROUP_RE.match(text, pos)
+                if open_group is None: continue
+                second_arg, pos = read_group(text, open_group.end())
+                if second_arg is None: break
+                arg = (arg.strip(), second_arg.strip())
+            else:
+                arg = arg.strip()
+            records.append((name, i_begin, pos, arg))
+            if name in CONTAINER_DIRECTIVES: pos = i_arg
+
+    # Unclosed figures run to the end of the text
+    for i_record in open_figures:
+        records[i_record] = ('figure', records[i_record][1], len(text), None)
+    return TexScan(records)
+
+
+def resolve_include(record, import_dir, root_dir):
+    """
+    Returns (path, import_dir) of the file an include record pulls in;
+    import_dir is the \\import directory of the including file, relative to
+    root_dir. \\input and \\include resolve relative to the import
+    directory first and root_dir second; \\import{dir}{file} resolves
+    relative to root_dir and \\subimport{dir}{file} relative to the import
+    directory, as with the LaTeX import package. A '.tex' extension is
+    tried first.
+    """
+    name, arg = record[0], record[3]
+    if name == 'import':
+        import_dir = os.path.normpath(arg[0])
+        candidates = [ os.path.join(root_dir, import_dir, arg[1]) ]
+    elif name == 'subimport':
+        import_dir = os.path.normpath(os.path.join(import_dir, arg[0]))
+        candidates = [ os.path.join(root_dir, import_dir, arg[1]) ]
+    else:
+        candidates = [
+            os.path.join(root_dir, import_dir, arg),
+            os.path.join(root_dir, arg),
+            ]
+    for candidate in candidates:
+        for path in [ candidate + '.tex', candidate ]:
+            if os.path.isfile(path):
+                return os.path.normpath(path), import_dir
+    path = candidates[0]
+    if not os.path.splitext(path)[1]: path += '.tex'
+    return os.path.normpath(path), import_dir
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import difflib
+import logging
+from collections import OrderedDict
+from timeit import default_timer
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from tex_index import TexIndex, TexProject
+from bib_index import BibIndex
+from bib_tex_matcher import BibTexMatcher
+from xref import XRefIndex
+
+#____________________________________________________________________
+# Keeping a warm parse of a tex project, re-reporting on changes
+
+
+class PollingWatcher(object):
+    """Finds changed files by comparing their mtime and size every interval seconds"""
+
+    def __init__(self, interval=0.5):
+        super(PollingWatcher, self).__init__()
+        self.interval = interval
+        # path -> (mtime, size), or None if the file does not exist
+        self.stats = {}
+
+    def stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def poll(self, paths):
+        """Returns the paths that changed since the previous poll"""
+        changed = []
+        stats = {}
+        for path in paths:
+            stats[path] = self.stat(path)
+            if path in self.stats and self.stats[path] != stats[path]:
+                changed.append(path)
+        self.stats = stats
+        return changed
+
+    def start(self, paths):
+        """Takes the baseline of the paths that have none yet"""
+        for path in paths:
+            if not path in self.stats: self.stats[path] = self.stat(path)
+
+    def wait(self, paths):
+        """
+        Blocks until any of paths changes; returns the changed paths. Changes
+        since the previous poll count, so saves made while the caller was busy
+        are reported; paths that were not polled before get their baseline.
+        """
+        while True:
+            changed = self.poll(paths)
+            if changed: return changed
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Finds changed files with inotify; requires pyinotify"""
+
+    def __init__(self, timeout=0.05):
+        super(InotifyWatcher, self).__init__()
+        self.timeout = timeout
+        self.mask = (
+            pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE | pyinotify.IN_DELETE
+            )
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.manager, self.handle)
+        # directory -> watch descriptor
+        self.watches = {}
+        self.events = set()
+
+    def handle(self, event):
+        self.events.add(os.path.normpath(event.pathname))
+
+    def watch_dirs(self, paths):
+        dirs = set( os.path.dirname(os.path.abspath(path)) for path in paths )
+        for directory in dirs - set(self.watches):
+            if not os.path.isdir(directory): continue
+            wdd = self.manager.add_watch(directory, self.mask)
+            self.watches[directory] = wdd[directory]
+        for directory in set(self.watches) - dirs:
+            self.manager.rm_watch(self.watches.pop(directory))
+
+    def start(self, paths):
+        """Starts collecting the events of paths"""
+        self.watch_dirs(set( os.path.normpath(os.path.abspath(path)) for path in paths ))
+
+    def wait(self, paths):
+        """Blocks until any of paths changes; returns the changed paths"""
+        paths = set( os.path.normpath(os.path.abspath(path)) for path in paths )
+        self.watch_dirs(paths)
+        changed = set()
+        while not changed:
+            self.notifier.check_events(timeout=None)
+            self.notifier.read_events()
+            self.notifier.process_events()
+            # Editors write in several steps; collect the events of a save
+            while self.notifier.check_events(timeout=int(1000*self.timeout)):
+                self.notifier.read_events()
+                self.notifier.process_events()
+            changed = self.events & paths
+            self.events = set()
+        return sorted(changed)
+
+    def close(self):
+        self.notifier.stop()
+
+
+def get_watcher(polling=False, interval=0.5):
+    """InotifyWatcher if pyinotify is available, PollingWatcher otherwise"""
+    if polling or pyinotify is None:
+        return PollingWatcher(interval)
+    return InotifyWatcher()
+
+
+class ProjectWatcher(object):
+    """
+    Keeps the scans of a tex project and the indices of its bib files in
+    memory, and reports missing cites, duplicate labels and the section
+    structure. After a change only the changed files are scanned again;
+    the include tree is stitched together from the kept scans.
+    """
+
+    def __init__(self, main_file, bibfiles=None):
+        super(ProjectWatcher, self).__init__()
+        self.main_file = os.path.abspath(main_file)
+        self.bibfiles = [ os.path.abspath(bibfile) for bibfile in (bibfiles or []) ]
+        # In memory only; unchanged files are never read again
+        self.index = TexIndex()
+        self.bib_indices = [ BibIndex(bibfile, path=None) for bibfile in self.bibfiles ]
+        self.project = None
+        # Report name -> lines
+        self.reports = OrderedDict()
+
+    def get_paths(self):
+        """Paths that affect the reports, including includes that do not exist yet"""
+        paths = [ self.main_file ] + self.bibfiles
+        if not(self.project is None):
+            paths.extend(self.project.get_paths())
+            paths.extend( path for node, record, path in self.project.missing )
+        return sorted(set(paths))
+
+    def reload(self):
+        self.project = TexProject(self.main_file, self.index)
+        for bib_index in self.bib_indices:
+            bib_index.refresh()
+
+        reports = OrderedDict()
+        if self.bib_indices:
+            matcher = BibTexMatcher([ self.project ], self.bib_indices).process()
+            reports['missing cites'] = [
+                '{0} ({1})'.format(key, ', '.join(self.format_location(location) for location in matcher.cites[key]))
+                for key in matcher.missing
+                ]
+
+        xref = XRefIndex.from_project(self.project)
+        reports['duplicate labels'] = [
+            '{0} ({1})'.format(label, ', '.join(self.format_location(location) for location in locations))
+            for label, locations in xref.get_duplicate_labels()
+            ]
+
+        structure = self.project.render_structure()
+        reports['structure'] = structure.split('\n') if structure else []
+        return reports
+
+    def format_location(self, location):
+        return '{0}:{1}'.format(os.path.relpath(location[0], self.project.root_dir), location[1])
+
+    def update(self):
+        """Reloads the project; returns the diff lines of every report that changed"""
+        old_reports = self.reports
+        try:
+            self.reports = self.reload()
+        except (IOError, OSError) as e:
+            # E.g. an editor that saves by removing and renaming
+            logging.warning('Could not reload {0}: {1}'.format(self.main_file, e))
+            return []
+        lines = []
+        for name, report in self.reports.iteritems():
+            old_report = old_reports.get(name, [])
+            if report == old_report: continue
+            lines.extend(difflib.unified_diff(old_report, report, name, name, n=0, lineterm=''))
+        return lines
+
+    def format_reports(self):
+        lines = []
+        for name, report in self.reports.iteritems():
+            lines.append('{0} ({1}):'.format(name, len(report)))
+            lines.extend( '    ' + line for line in report )
+        return lines
+
+    def run(self, watcher=None, stream=None):
+        if watcher is None: watcher = get_watcher()
+        if stream is None: stream = sys.stdout
+        # Before the update, so that the main file and bib files saved during it are reported
+        watcher.start(self.get_paths())
+        self.update()
+        # The includes are only known now
+        watcher.start(self.get_paths())
+        stream.write('\n'.join(self.format_reports()) + '\n')
+        stream.flush()
+        try:
+            while True:
+                changed = watcher.wait(self.get_paths())
+                t_start = default_timer()
+                lines = self.update()
+                stream.write('{0}: updated in {1:.1f} ms\n'.format(
+                    ', '.join( os.path.relpath(path, self.project.root_dir) for path in changed ),
+                    1000. * (default_timer() - t_start)
+                    ))
+                if lines: stream.write('\n'.join(lines) + '\n')
+                stream.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
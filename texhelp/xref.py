@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import os
+from collections import OrderedDict
+
+from tex_scanner import REF_DIRECTIVES
+
+#____________________________________________________________________
+# Cross-reference index of \label and \ref-like directives
+
+
+def split_ref_keys(kind, arg):
+    """Labels a ref refers to; \\cref takes a comma-separated list"""
+    if kind == 'cref':
+        return [ key.strip() for key in arg.split(',') if key.strip() ]
+    return [ arg.strip() ]
+
+
+def get_block_location(block, name=None):
+    path = getattr(block, 'path', None)
+    return (name if path is None else path, block.i_begin)
+
+
+class XRefIndex(object):
+    """
+    Labels and refs by name, with the (file, offset) locations they occur
+    at, collected in one pass over the include tree. Duplicate labels,
+    dangling refs and unreferenced labels are then dict lookups.
+    """
+
+    def __init__(self):
+        super(XRefIndex, self).__init__()
+        # label -> [ location ], in document order
+        self.labels = OrderedDict()
+        # label -> [ (kind, location) ], in order of first reference; from_tree
+        # adds the refs one kind at a time
+        self.refs = OrderedDict()
+
+    @classmethod
+    def from_project(cls, project):
+        """Index of a TexProject; locations are (path, offset)"""
+        index = cls()
+        for node, record in project.gen_records('label', *REF_DIRECTIVES):
+            location = (node.path, record[1])
+            if record[0] == 'label':
+                index.add_label(record[3], location)
+            else:
+                index.add_ref(record[0], record[3], location)
+        return index
+
+    @classmethod
+    def from_tree(cls, tree, name=None):
+        """
+        Index of a TexInterpreter tree; locations are (path, offset), with the
+        path of the file the block was parsed from, or name if it is unknown
+        """
+        index = cls()
+        for node in tree.gen_blocks_by_name('label'):
+            index.add_label(node.block.get_text_no_tags().strip(), get_block_location(node.block, name))
+        for kind in REF_DIRECTIVES:
+            for node in tree.gen_blocks_by_name(kind):
+                index.add_ref(kind, node.block.get_text_no_tags(), get_block_location(node.block, name))
+        return index
+
+    def add_label(self, label, location):
+        locations = self.labels.get(label)
+        if locations is None:
+            self.labels[label] = [ location ]
+        else:
+            locations.append(location)
+
+    def add_ref(self, kind, arg, location):
+        for key in split_ref_keys(kind, arg):
+            refs = self.refs.get(key)
+            if refs is None:
+                self.refs[key] = [ (kind, location) ]
+            else:
+                refs.append((kind, location))
+
+    def update(self, other):
+        """Adds the labels and refs of another index, e.g. of another document"""
+        for label, locations in other.labels.iteritems():
+            for location in locations:
+                self.add_label(label, location)
+        for key, refs in other.refs.iteritems():
+            self.refs.setdefault(key, []).extend(refs)
+        return self
+
+    def get_duplicate_labels(self):
+        """[ (label, locations) ] of labels that are defined more than once"""
+        return [ (label, locations) for label, locations in self.labels.iteritems() if len(locations) > 1 ]
+
+    def get_dangling_refs(self):
+        """[ (label, [ (kind, location) ]) ] of refs to labels that are not defined"""
+        return [ (key, refs) for key, refs in self.refs.iteritems() if not key in self.labels ]
+
+    def get_unreferenced_labels(self):
+        """[ (label, locations) ] of labels that are never referred to"""
+        return [ (label, locations) for label, locations in self.labels.iteritems() if not label in self.refs ]
+
+
+def format_location(location, root_dir=None):
+    path, offset = location
+    if not(root_dir is None) and not(path is None): path = os.path.relpath(path, root_dir)
+    return '{0}:{1}'.format(path, offset)